@@ -0,0 +1,9 @@
+from v360.metrics import clear_host_files, mark_process_dead
+
+
+def on_starting(server):
+    clear_host_files()
+
+
+def child_exit(server, worker):
+    mark_process_dead(worker.pid)
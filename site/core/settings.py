@@ -162,13 +162,172 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# STORAGE
+MEDIA_STORAGE = env.str('MEDIA_STORAGE', default='local')  # local - общий том media, s3 - S3-совместимое хранилище
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+if MEDIA_STORAGE == 's3':
+    STORAGES['default'] = {
+        'BACKEND': 'storages.backends.s3.S3Storage',
+        'OPTIONS': {
+            'bucket_name': env.str('S3_BUCKET'),
+            'endpoint_url': env.str('S3_ENDPOINT_URL', default=None),  # MinIO и другие S3-совместимые хранилища
+            'region_name': env.str('S3_REGION', default=None),
+            'access_key': env.str('S3_ACCESS_KEY', default=None),
+            'secret_key': env.str('S3_SECRET_KEY', default=None),
+            'custom_domain': env.str('S3_CUSTOM_DOMAIN', default=None),  # CDN перед бакетом, ссылки без подписи
+            'querystring_auth': env.bool('S3_PRESIGNED_URLS', default=True),
+            'querystring_expire': env.int('S3_PRESIGNED_EXPIRE', default=3600),
+            'addressing_style': env.str('S3_ADDRESSING_STYLE', default='path'),
+            'file_overwrite': True,
+        },
+    }
+STORAGE_TRANSFER_WORKERS = env.int('STORAGE_TRANSFER_WORKERS', default=16)  # Параллельных загрузок и скачиваний в процессе
+STORAGE_MULTIPART_THRESHOLD_MB = env.int('STORAGE_MULTIPART_THRESHOLD_MB', default=8)  # Файлы больше загружаются частями
+STORAGE_MULTIPART_CHUNK_MB = env.int('STORAGE_MULTIPART_CHUNK_MB', default=8)
+STORAGE_MULTIPART_CONCURRENCY = env.int('STORAGE_MULTIPART_CONCURRENCY', default=4)  # Частей одного файла параллельно
+STORAGE_LOCAL_CACHE_MB = env.int('STORAGE_LOCAL_CACHE_MB', default=10240)  # Локальные копии кадров из s3, старые удаляются первыми
+STORAGE_LOCAL_CACHE_INTERVAL = env.int('STORAGE_LOCAL_CACHE_INTERVAL', default=600)  # Как часто проверять размер копий, секунд
+
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 20000
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760
 
+# CACHE
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': env.str('CACHE_REDIS_URL', default='redis://redis:6379/1'),
+    },
+    'chunks': {  # Готовые ответы чанков, ключ содержит версию кадров
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': env.str('CHUNK_CACHE_REDIS_URL', default='redis://redis:6379/2'),
+        'TIMEOUT': env.int('CHUNK_CACHE_TTL', default=24 * 3600),
+    },
+}
+if env.str('CHUNK_CACHE_DIR', default=''):
+    # Локальный диск вместо Redis, при превышении MAX_ENTRIES удаляется треть записей
+    CACHES['chunks'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env.str('CHUNK_CACHE_DIR'),
+        'TIMEOUT': env.int('CHUNK_CACHE_TTL', default=24 * 3600),
+        'OPTIONS': {'MAX_ENTRIES': env.int('CHUNK_CACHE_MAX_ENTRIES', default=20000), 'CULL_FREQUENCY': 3},
+    }
+CHUNK_CACHE_MAX_ITEM_KB = env.int('CHUNK_CACHE_MAX_ITEM_KB', default=8192)  # Чанки больше не кэшируются
+
 # CELERY
 CELERY_BROKER_URL = env.str('CELERY_BROKER_URL')
 CELERY_RESULT_BACKEND = 'django-db'
 CELERY_ENABLE_UTC = False
 CELERY_ACKS_LATE = True  # Задачи подтверждаются только после выполнения
 CELERY_TASK_REJECT_ON_WORKER_LOST = True  # Задачи возвращаются в очередь, если воркер теряется
-CELERY_RETRY_DELAY = 60  # Задержка перед повторной попыткой выполнения задачи
\ No newline at end of file
+CELERY_RETRY_DELAY = 60  # Задержка перед повторной попыткой выполнения задачи
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1  # Воркер не забирает задачи впрок, очередь не стоит за долгим парсингом
+
+# QUEUES
+QUEUE_INTERACTIVE = env.str('QUEUE_INTERACTIVE', default='interactive')  # Ручной парсинг, пользователь ждет результат
+QUEUE_BULK = env.str('QUEUE_BULK', default='bulk')  # Фиды на тысячи камней
+QUEUE_VIDEO = env.str('QUEUE_VIDEO', default='video')  # Видео, превью, атласы и уменьшенные копии
+QUEUE_PRIORITIES = {  # Приоритет задач внутри очереди, 0 - высший
+    QUEUE_INTERACTIVE: env.int('QUEUE_INTERACTIVE_PRIORITY', default=0),
+    QUEUE_BULK: env.int('QUEUE_BULK_PRIORITY', default=6),
+    QUEUE_VIDEO: env.int('QUEUE_VIDEO_PRIORITY', default=3),
+}
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+CELERY_TASK_DEFAULT_QUEUE = QUEUE_BULK
+CELERY_TASK_ROUTES = {
+    'v360.tasks.parse_v360_data': {'queue': QUEUE_INTERACTIVE, 'priority': QUEUE_PRIORITIES[QUEUE_INTERACTIVE]},
+    'v360.tasks.make_queue': {'queue': QUEUE_BULK, 'priority': QUEUE_PRIORITIES[QUEUE_BULK]},
+    'v360.tasks.parse_v360_batch': {'queue': QUEUE_BULK, 'priority': QUEUE_PRIORITIES[QUEUE_BULK]},
+    'v360.tasks.build_atlas': {'queue': QUEUE_VIDEO, 'priority': QUEUE_PRIORITIES[QUEUE_VIDEO]},
+    'v360.tasks.build_derivatives': {'queue': QUEUE_VIDEO, 'priority': QUEUE_PRIORITIES[QUEUE_VIDEO]},
+    'v360.tasks.build_previews': {'queue': QUEUE_VIDEO, 'priority': QUEUE_PRIORITIES[QUEUE_VIDEO]},
+    'v360.tasks.render_video': {'queue': QUEUE_VIDEO, 'priority': QUEUE_PRIORITIES[QUEUE_VIDEO]},
+}
+
+# PARSER
+PARSER_BROWSER_POOL_SIZE = env.int('PARSER_BROWSER_POOL_SIZE', default=4)  # Одновременно открытых страниц в воркере
+PARSER_BROWSER_MAX_PAGES = env.int('PARSER_BROWSER_MAX_PAGES', default=200)  # Перезапуск браузера после N страниц
+PARSER_BROWSER_MAX_RSS_MB = env.int('PARSER_BROWSER_MAX_RSS_MB', default=2048)  # Перезапуск браузера при превышении памяти
+PARSER_BATCH_SIZE = env.int('PARSER_BATCH_SIZE', default=20)  # Камней в одной batch-задаче
+PARSER_BATCH_CONCURRENCY = env.int('PARSER_BATCH_CONCURRENCY', default=4)  # Камней, парсящихся одновременно в batch-задаче
+PARSER_FRAMES_QUIET_SECONDS = env.float('PARSER_FRAMES_QUIET_SECONDS', default=2)  # Набор кадров считается полным, если нет новых кадров N секунд
+PARSER_FETCH_CONCURRENCY = env.int('PARSER_FETCH_CONCURRENCY', default=16)  # Одновременных HTTP-запросов за кадрами
+PARSER_FETCH_RETRIES = env.int('PARSER_FETCH_RETRIES', default=3)
+PARSER_FETCH_TIMEOUT = env.float('PARSER_FETCH_TIMEOUT', default=30)
+PATTERN_INDEX_CHECK_SECONDS = env.int('PATTERN_INDEX_CHECK_SECONDS', default=30)  # Как часто проверять версию индекса LinkPatterns
+PARSER_WRITE_WORKERS = env.int('PARSER_WRITE_WORKERS', default=4)  # Потоков для декодирования и записи кадров
+PARSER_WRITE_QUEUE = env.int('PARSER_WRITE_QUEUE', default=32)  # Кадров в очереди на запись на один камень
+PARSER_HOST_RATE = env.float('PARSER_HOST_RATE', default=10)  # Запросов в секунду к одному хосту вендора со всех воркеров
+PARSER_HOST_BURST = env.int('PARSER_HOST_BURST', default=20)
+PARSER_HOST_RATE_OVERRIDES = {  # Лимиты для отдельных хостов, действуют и на поддомены
+    # 'v360.in': {'rate': 5, 'burst': 10},
+}
+PARSER_HOST_CONCURRENCY = env.int('PARSER_HOST_CONCURRENCY', default=4)  # Начальное число одновременных запросов к хосту в воркере
+PARSER_HOST_CONCURRENCY_MIN = env.int('PARSER_HOST_CONCURRENCY_MIN', default=1)
+PARSER_HOST_CONCURRENCY_MAX = env.int('PARSER_HOST_CONCURRENCY_MAX', default=32)
+PARSER_HOST_LATENCY_FACTOR = env.float('PARSER_HOST_LATENCY_FACTOR', default=3)  # Снижать параллельность, если задержка выросла в N раз
+PARSER_HOST_ERROR_RATE = env.float('PARSER_HOST_ERROR_RATE', default=0.1)  # Снижать параллельность при такой доле ошибок
+PARSER_RETRY_MAX = env.int('PARSER_RETRY_MAX', default=5)  # Повторов парсинга при временных ошибках
+PARSER_RETRY_BASE_DELAY = env.int('PARSER_RETRY_BASE_DELAY', default=30)  # Задержка первого повтора, дальше удваивается
+PARSER_RETRY_MAX_DELAY = env.int('PARSER_RETRY_MAX_DELAY', default=900)
+
+# ATLAS
+ATLAS_LEVELS = {  # Ширина кадра в атласе, None - исходный размер. Первый уровень показывается как превью
+    'thumbnail': 160,
+    'medium': 480,
+}
+ATLAS_MAX_SIZE = env.int('ATLAS_MAX_SIZE', default=4096)  # Максимальная сторона одного атласа
+ATLAS_FORMAT = env.str('ATLAS_FORMAT', default='WEBP')  # WEBP или JPEG
+ATLAS_QUALITY = env.int('ATLAS_QUALITY', default=80)
+
+# DERIVATIVES
+DERIVATIVE_SIZES = env.list('DERIVATIVE_SIZES', cast=int, default=[256, 512, 1024])  # Ширина уменьшенных копий кадров
+DERIVATIVE_FORMATS = env.list('DERIVATIVE_FORMATS', default=['WEBP', 'JPEG'])  # Первый формат используется для бандлов
+DERIVATIVE_QUALITY = env.int('DERIVATIVE_QUALITY', default=80)
+
+# VIDEO
+VIDEO_CACHE_MAX_MB = env.int('VIDEO_CACHE_MAX_MB', default=5120)  # Размер кэша видео, старые удаляются первыми
+VIDEO_RENDER_LOCK_SECONDS = env.int('VIDEO_RENDER_LOCK_SECONDS', default=1800)  # Один рендер на камень за это время
+VIDEO_RENDER_FAILED_SECONDS = env.int('VIDEO_RENDER_FAILED_SECONDS', default=600)  # После ошибки рендер не повторяется это время
+VIDEO_X_ACCEL = env.bool('VIDEO_X_ACCEL', default=False)  # Отдавать видео через nginx X-Accel-Redirect
+VIDEO_FPS = env.int('VIDEO_FPS', default=24)
+VIDEO_CODEC = env.str('VIDEO_CODEC', default='libx264')
+VIDEO_PRESET = env.str('VIDEO_PRESET', default='slow')  # Пресет x264/x265
+VIDEO_CRF = env.int('VIDEO_CRF', default=23)  # Качество, меньше - лучше
+
+# PREVIEWS
+PREVIEWS = {  # Короткие превью для списков: ширина, каждый N-й кадр, fps
+    'webp': {'width': 320, 'step': 4, 'fps': 12},
+    'gif': {'width': 240, 'step': 8, 'fps': 8},
+    'mp4': {'width': 480, 'step': 2, 'fps': 24, 'preset': 'veryfast', 'crf': 30},
+}
+PREVIEW_QUALITY = env.int('PREVIEW_QUALITY', default=70)
+
+# PARSE STATE
+PARSE_STATE_TTL = env.int('PARSE_STATE_TTL', default=7 * 24 * 3600)  # Время жизни статуса парсинга в Redis, источник истины - БД
+PARSER_IN_FLIGHT_SECONDS = env.int('PARSER_IN_FLIGHT_SECONDS', default=3600)  # Сколько камень в очереди не ставится повторно
+PARSER_COMPLETE_FRAMES = env.int('PARSER_COMPLETE_FRAMES', default=256)  # Кадров в полном наборе, камни с меньшим числом парсятся заново
+
+# PARSE EVENTS
+PARSE_EVENTS_BATCH_SIZE = env.int('PARSE_EVENTS_BATCH_SIZE', default=100)  # Событий в одной вставке
+PARSE_EVENTS_RETENTION_DAYS = env.int('PARSE_EVENTS_RETENTION_DAYS', default=30)  # Старые события удаляет beat-задача
+CELERY_BEAT_SCHEDULE = {
+    'prune-parse-events': {
+        'task': 'v360.tasks.prune_parse_events',
+        'schedule': 3600,
+    },
+    'sweep-frame-blobs': {
+        'task': 'v360.tasks.sweep_frame_blobs',
+        'schedule': 6 * 3600,
+    },
+}
@@ -15,12 +15,103 @@ class Loader360 {
         this.percentLoaded = 0;
         this.totalImages = null;
         this.progress = document.querySelector('.progress-bar');
+        // Frame width actually needed, the server picks the closest stored variant
+        this.resolution = Math.ceil(document.body.clientWidth * (window.devicePixelRatio || 1));
         this.certificate = certificate;
-        this.preFetchChunks();
+        this.load();
+    }
+    load() {
+        return __awaiter(this, void 0, void 0, function* () {
+            this.preFetchAtlas();
+            const manifest = yield this.fetchManifest();
+            if (manifest) {
+                this.preFetchBundles(manifest);
+            }
+            else {
+                this.preFetchChunks();
+            }
+        });
+    }
+    // Low resolution spin from the preview atlas, replaced frame by frame by full images
+    preFetchAtlas() {
+        return __awaiter(this, void 0, void 0, function* () {
+            const url = `/v360/get/${this.certificate}/`;
+            const response = yield ajax(url, JSON.stringify({ atlas: true }));
+            if (!response || !response.levels) {
+                return;
+            }
+            const atlas = response;
+            const level = atlas.levels[atlas.preview];
+            if (this.totalImages === null) {
+                this.totalImages = atlas.frame_count;
+            }
+            this.initTextureMap();
+            level.atlases.forEach((sheet) => {
+                const img = new Image();
+                img.src = sheet.url;
+                img.onload = () => {
+                    sheet.frames.forEach((frame, position) => {
+                        if (!this.textureMap[frame]) {
+                            this.textureMap[frame] = {
+                                image: img,
+                                x: (position % level.columns) * level.frame_width,
+                                y: Math.floor(position / level.columns) * level.frame_height,
+                                width: level.frame_width,
+                                height: level.frame_height,
+                                lowRes: true,
+                            };
+                        }
+                    });
+                };
+            });
+        });
+    }
+    fetchManifest() {
+        return __awaiter(this, void 0, void 0, function* () {
+            try {
+                const response = yield fetch(`/v360/get/${this.certificate}/bundles/?resolution=${this.resolution}`);
+                if (!response.ok) {
+                    return null;
+                }
+                return yield response.json();
+            }
+            catch (error) {
+                return null;
+            }
+        });
+    }
+    preFetchBundles(manifest) {
+        return __awaiter(this, void 0, void 0, function* () {
+            this.totalImages = manifest.total_images;
+            for (const chunk of manifest.chunks) {
+                const response = yield fetch(chunk.url);
+                if (!response.ok) {
+                    break;
+                }
+                this.updatePercentLoaded(manifest.total_chunks, chunk.chunk_index);
+                this.updateTextureMap(this.unpackBundle(yield response.arrayBuffer()));
+                this.updateProgress();
+            }
+            this.isFetchingFinished = true;
+        });
+    }
+    // Bundle layout: uint32 frame index, uint32 length, image bytes, repeated
+    unpackBundle(buffer) {
+        const view = new DataView(buffer);
+        const items = [];
+        let offset = 0;
+        while (offset + 8 <= buffer.byteLength) {
+            const index = view.getUint32(offset);
+            const length = view.getUint32(offset + 4);
+            offset += 8;
+            items.push({ index, src: URL.createObjectURL(new Blob([buffer.slice(offset, offset + length)])) });
+            offset += length;
+        }
+        return items;
     }
     fetchChunk(chunkIndex) {
         return __awaiter(this, void 0, void 0, function* () {
-            const data = { chunk_index: chunkIndex };
+            const data = { chunk_index: chunkIndex, resolution: this.resolution, format: 'jpeg' };
             const url = `/v360/get/${this.certificate}/`;
             const response = yield ajax(url, JSON.stringify(data));
             if (!Array.isArray(response.chunk)) {
@@ -40,23 +131,27 @@ class Loader360 {
                 this.totalImages = response.total_images;
             }
             this.updatePercentLoaded(response.total_chunks, response.chunk_index);
-            this.updateTextureMap(response.chunk);
+            this.updateTextureMap(response.chunk.map((item) => ({ index: item.index, src: `data:image/jpeg;base64,${item.base64}` })));
             this.preFetchChunks(response.chunk_index + 1);
             this.updateProgress();
         });
     }
-    updateTextureMap(chunk) {
+    initTextureMap() {
         if (Object.keys(this.textureMap).length === 0) {
             for (let i = 1; i <= this.totalImages; i++) {
                 this.textureMap[i] = null;
             }
         }
+    }
+    updateTextureMap(chunk) {
+        this.initTextureMap();
         chunk.forEach((item) => {
             const img = new Image();
-            img.src = `data:image/jpeg;base64,${item.base64}`;
+            img.src = item.src;
             img.onload = () => {
-                if (!this.textureMap[item.index]) {
-                    this.textureMap[item.index] = img;
+                const texture = this.textureMap[item.index];
+                if (!texture || texture.lowRes) {
+                    this.textureMap[item.index] = { image: img, x: 0, y: 0, width: img.width, height: img.height, lowRes: false };
                 }
             };
         });
@@ -146,7 +241,7 @@ class View360 {
         const texture = this.textures[this.currentIndex];
         if (texture) {
             this.context.clearRect(0, 0, this.canvas.width, this.canvas.height);
-            this.context.drawImage(texture, 0, 0, this.canvas.width, this.canvas.height);
+            this.context.drawImage(texture.image, texture.x, texture.y, texture.width, texture.height, 0, 0, this.canvas.width, this.canvas.height);
         }
     }
     addListeners() {
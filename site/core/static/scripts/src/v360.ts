@@ -1,7 +1,16 @@
 import { ajax } from "./ajax.js";
 
+interface ITexture {
+	image: HTMLImageElement;
+	x: number;
+	y: number;
+	width: number;
+	height: number;
+	lowRes: boolean;
+}
+
 interface TextureMap {
-	[index: number]: HTMLImageElement | null;
+	[index: number]: ITexture | null;
 }
 
 interface IChunkItem {
@@ -16,6 +25,43 @@ interface IChunk {
 	chunk_index: number;
 }
 
+interface IFrameItem {
+	index: number;
+	src: string;
+}
+
+interface IBundleChunk {
+	chunk_index: number;
+	url: string;
+	key_points: number[];
+}
+
+interface IManifest {
+	version: string;
+	total_images: number;
+	total_chunks: number;
+	chunks: IBundleChunk[];
+}
+
+interface IAtlasSheet {
+	url: string;
+	frames: number[];
+}
+
+interface IAtlasLevel {
+	frame_width: number;
+	frame_height: number;
+	columns: number;
+	atlases: IAtlasSheet[];
+}
+
+interface IAtlasManifest {
+	version: string;
+	frame_count: number;
+	preview: string;
+	levels: { [name: string]: IAtlasLevel };
+}
+
 class Loader360 {
 	private certificate: string;
 	private textureMap: TextureMap = {};
@@ -23,14 +69,101 @@ class Loader360 {
 	private percentLoaded: number = 0;
 	private totalImages: number | null = null;
 	private progress = document.querySelector('.progress-bar') as HTMLElement;
+	// Frame width actually needed, the server picks the closest stored variant
+	private resolution: number = Math.ceil(document.body.clientWidth * (window.devicePixelRatio || 1));
 
 	constructor(certificate: string) {
 		this.certificate = certificate;
-		this.preFetchChunks();
+		this.load();
+	}
+
+	private async load(): Promise<void> {
+		this.preFetchAtlas();
+		const manifest = await this.fetchManifest();
+		if (manifest) {
+			this.preFetchBundles(manifest);
+		} else {
+			this.preFetchChunks();
+		}
+	}
+
+	// Low resolution spin from the preview atlas, replaced frame by frame by full images
+	private async preFetchAtlas(): Promise<void> {
+		const url = `/v360/get/${this.certificate}/`;
+		const response = await ajax(url, JSON.stringify({ atlas: true }));
+		if (!response || !response.levels) {
+			return;
+		}
+		const atlas = response as IAtlasManifest;
+		const level = atlas.levels[atlas.preview];
+		if (this.totalImages === null) {
+			this.totalImages = atlas.frame_count;
+		}
+		this.initTextureMap();
+
+		level.atlases.forEach((sheet) => {
+			const img = new Image();
+			img.src = sheet.url;
+			img.onload = () => {
+				sheet.frames.forEach((frame, position) => {
+					if (!this.textureMap[frame]) {
+						this.textureMap[frame] = {
+							image: img,
+							x: (position % level.columns) * level.frame_width,
+							y: Math.floor(position / level.columns) * level.frame_height,
+							width: level.frame_width,
+							height: level.frame_height,
+							lowRes: true,
+						};
+					}
+				});
+			};
+		});
+	}
+
+	private async fetchManifest(): Promise<IManifest | null> {
+		try {
+			const response = await fetch(`/v360/get/${this.certificate}/bundles/?resolution=${this.resolution}`);
+			if (!response.ok) {
+				return null;
+			}
+			return await response.json() as IManifest;
+		} catch (error) {
+			return null;
+		}
+	}
+
+	private async preFetchBundles(manifest: IManifest): Promise<void> {
+		this.totalImages = manifest.total_images;
+		for (const chunk of manifest.chunks) {
+			const response = await fetch(chunk.url);
+			if (!response.ok) {
+				break;
+			}
+			this.updatePercentLoaded(manifest.total_chunks, chunk.chunk_index);
+			this.updateTextureMap(this.unpackBundle(await response.arrayBuffer()));
+			this.updateProgress();
+		}
+		this.isFetchingFinished = true;
+	}
+
+	// Bundle layout: uint32 frame index, uint32 length, image bytes, repeated
+	private unpackBundle(buffer: ArrayBuffer): IFrameItem[] {
+		const view = new DataView(buffer);
+		const items: IFrameItem[] = [];
+		let offset = 0;
+		while (offset + 8 <= buffer.byteLength) {
+			const index = view.getUint32(offset);
+			const length = view.getUint32(offset + 4);
+			offset += 8;
+			items.push({ index, src: URL.createObjectURL(new Blob([buffer.slice(offset, offset + length)])) });
+			offset += length;
+		}
+		return items;
 	}
 
 	private async fetchChunk(chunkIndex: number): Promise<IChunk> {
-		const data = { chunk_index: chunkIndex };
+		const data = { chunk_index: chunkIndex, resolution: this.resolution, format: 'jpeg' };
 		const url = `/v360/get/${this.certificate}/`;
 		const response = await ajax(url, JSON.stringify(data));
 		if (!Array.isArray(response.chunk)) {
@@ -50,24 +183,29 @@ class Loader360 {
 			this.totalImages = response.total_images;
 		}
 		this.updatePercentLoaded(response.total_chunks, response.chunk_index);
-		this.updateTextureMap(response.chunk);
+		this.updateTextureMap(response.chunk.map((item) => ({ index: item.index, src: `data:image/jpeg;base64,${item.base64}` })));
 		this.preFetchChunks(response.chunk_index + 1);
 		this.updateProgress();
 	}
 
-	private updateTextureMap(chunk: IChunkItem[]): void {
+	private initTextureMap(): void {
 		if (Object.keys(this.textureMap).length === 0) {
 			for (let i = 1; i <= (this.totalImages as number); i++) {
 				this.textureMap[i] = null;
 			}
 		}
+	}
+
+	private updateTextureMap(chunk: IFrameItem[]): void {
+		this.initTextureMap();
 
 		chunk.forEach((item) => {
 			const img = new Image();
-			img.src = `data:image/jpeg;base64,${item.base64}`;
+			img.src = item.src;
 			img.onload = () => {
-				if (!this.textureMap[item.index]) {
-					this.textureMap[item.index] = img;
+				const texture = this.textureMap[item.index];
+				if (!texture || texture.lowRes) {
+					this.textureMap[item.index] = { image: img, x: 0, y: 0, width: img.width, height: img.height, lowRes: false };
 				}
 			};
 		});
@@ -175,7 +313,7 @@ class View360 {
 	
 		if (texture) {
 			this.context.clearRect(0, 0, this.canvas.width, this.canvas.height);
-			this.context.drawImage(texture, 0, 0, this.canvas.width, this.canvas.height);
+			this.context.drawImage(texture.image, texture.x, texture.y, texture.width, texture.height, 0, 0, this.canvas.width, this.canvas.height);
 		}
 	}
 
@@ -1,10 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
+from v360.views import MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('v360/', include('v360.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
 
 if settings.DEBUG:
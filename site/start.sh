@@ -21,7 +21,7 @@ EOF
 
 # Запуск сервера Gunicorn
 echo "Запуск Gunicorn..."
-exec gunicorn --workers=3 --bind=0.0.0.0:8000 core.wsgi:application --timeout 400
+exec gunicorn --workers=3 --bind=0.0.0.0:8000 core.wsgi:application --timeout 400 --config core/gunicorn_conf.py
 # exec python manage.py runserver 0.0.0.0:8000
 
  
\ No newline at end of file
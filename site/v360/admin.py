@@ -1,9 +1,8 @@
 from django.contrib import admin
-from .models import Stone, StoneImages, LinkPatterns, StoneLog
+from .models import Stone, StoneImages, LinkPatterns, StoneLog, StoneParseState, ParseEvent, FrameBlob
 from django.utils.html import format_html
 from django.utils.html import mark_safe
 from django.conf import settings
-from django.db import models
 
 class StoneNotInFilter(admin.SimpleListFilter):
     title = 'stone not in Stones'
@@ -32,18 +31,19 @@ class StoneNoneImagesFilter(admin.SimpleListFilter):
 
     def queryset(self, request, queryset):
         if self.value() == '256_plus':
-            return queryset.annotate(image_count=models.Count('images')).filter(image_count__gte=256)
+            return queryset.filter(image_count__gte=256)
         if self.value() == 'less_than_256':
-            return queryset.annotate(image_count=models.Count('images')).filter(image_count__lt=256)
+            return queryset.filter(image_count__lt=256)
         return queryset
 
 @admin.register(Stone)
 class StoneAdmin(admin.ModelAdmin):
-    list_display = ('certificate', 'vendor', 'created_at', 'images_count', 'view_source', 'view_stone', 'generate_video')
+    list_display = ('certificate', 'vendor', 'created_at', 'image_count', 'frame_info', 'view_source', 'view_stone', 'generate_video')
     search_fields = ('certificate', 'base_url',)
     ordering = ('-created_at',)
     
     list_filter = ('vendor', 'created_at', StoneNoneImagesFilter)
+    readonly_fields = ('image_count', 'frames')
     
     def view_source(self, obj):
         return format_html(
@@ -67,9 +67,13 @@ class StoneAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         self.request = request
         return super().get_queryset(request)
-    
-    def images_count(self, obj):
-        return StoneImages.objects.filter(stone=obj).count()
+
+    def frame_info(self, obj):
+        if not obj.frames:
+            return '-'
+        if 'blobs' in obj.frames:
+            return f"{obj.frames['width']}x{obj.frames['height']} {len(set(obj.frames['blobs']))} unique"
+        return f"{obj.frames['width']}x{obj.frames['height']} {obj.frames.get('format') or 'mixed'}"
     
     
 @admin.register(StoneImages)
@@ -99,4 +103,32 @@ class StoneLogAdmin(admin.ModelAdmin):
     list_display = ('stone', 'created_at', 'updated_at', 'log')
     search_fields = ('stone', 'log')
     list_filter = ('created_at', 'updated_at', StoneNotInFilter)
-    ordering = ('-created_at',)
\ No newline at end of file
+    ordering = ('-created_at',)
+
+
+@admin.register(StoneParseState)
+class StoneParseStateAdmin(admin.ModelAdmin):
+    list_display = ('certificate', 'state', 'image_count', 'queued_at', 'started_at', 'finished_at')
+    search_fields = ('certificate', 'error')
+    list_filter = ('state', 'finished_at')
+    ordering = ('-updated_at',)
+
+
+
+@admin.register(ParseEvent)
+class ParseEventAdmin(admin.ModelAdmin):
+    list_display = ('certificate', 'stage', 'outcome', 'duration', 'created_at', 'error')
+    # Exact match keeps the search on the certificate index
+    search_fields = ('=certificate',)
+    list_filter = ('outcome', 'stage', 'created_at')
+    ordering = ('-created_at',)
+    show_full_result_count = False
+
+
+@admin.register(FrameBlob)
+class FrameBlobAdmin(admin.ModelAdmin):
+    list_display = ('digest', 'extension', 'size', 'refcount', 'created_at')
+    search_fields = ('=digest',)
+    list_filter = ('extension', 'created_at')
+    ordering = ('-refcount',)
+    readonly_fields = ('digest', 'extension', 'size', 'refcount', 'created_at')
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class V360Config(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'v360'
+
+    def ready(self):
+        from . import blobs  # noqa: F401 - connects the stone file cleanup signal
+        from . import chunk_cache  # noqa: F401 - connects the chunk cache invalidation signal
+        from . import parse_state  # noqa: F401 - connects the parse state reset signal
+        from . import patterns  # noqa: F401 - connects the pattern index signals
@@ -0,0 +1,116 @@
+import json
+import logging
+import math
+import os
+import shutil
+from PIL import Image
+from django.conf import settings
+from .bundles import frames_version
+from .models import get_stone_folder_path
+
+logger = logging.getLogger(__name__)
+
+ATLAS_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def get_atlas_folder_path(certificate: str):
+    return os.path.join(get_stone_folder_path(certificate), 'atlas')
+
+
+def get_atlas_manifest_path(certificate: str):
+    return os.path.join(settings.MEDIA_ROOT, get_atlas_folder_path(certificate), 'atlas.json')
+
+
+def level_size(source_size: tuple[int, int], width: int | None) -> tuple[int, int]:
+    source_width, source_height = source_size
+    if not width or width >= source_width:
+        return source_width, source_height
+    return width, max(round(source_height * width / source_width), 1)
+
+
+def build_level(image_paths: list[str], indexes: list[int], frame_size: tuple[int, int], folder: str, name: str) -> dict:
+    frame_width, frame_height = frame_size
+    max_size = settings.ATLAS_MAX_SIZE
+    columns = max(max_size // frame_width, 1)
+    rows = max(max_size // frame_height, 1)
+    per_atlas = columns * rows
+
+    image_format = settings.ATLAS_FORMAT
+    extension = ATLAS_EXTENSIONS[image_format]
+
+    atlases = []
+    for start in range(0, len(image_paths), per_atlas):
+        paths = image_paths[start:start + per_atlas]
+        used_rows = math.ceil(len(paths) / columns)
+        used_columns = min(len(paths), columns)
+
+        sheet = Image.new('RGB', (used_columns * frame_width, used_rows * frame_height))
+        for position, path in enumerate(paths):
+            with Image.open(path) as frame:
+                frame = frame.convert('RGB')
+                if frame.size != frame_size:
+                    frame = frame.resize(frame_size, Image.Resampling.LANCZOS)
+                sheet.paste(frame, ((position % columns) * frame_width, (position // columns) * frame_height))
+
+        path = os.path.join(folder, f'{name}_{len(atlases)}.{extension}')
+        sheet.save(os.path.join(settings.MEDIA_ROOT, path), image_format, quality=settings.ATLAS_QUALITY)
+        sheet.close()
+        atlases.append({'path': path, 'frames': indexes[start:start + per_atlas]})
+
+    return {
+        'frame_width': frame_width,
+        'frame_height': frame_height,
+        'columns': columns,
+        'atlases': atlases,
+    }
+
+
+def build_stone_atlas(stone) -> dict:
+    image_paths = stone.frame_paths()
+    if not image_paths:
+        raise ValueError(f"No images found for stone: {stone.certificate}")
+
+    version = frames_version(image_paths)
+    atlas_dir = get_atlas_folder_path(stone.certificate)
+    version_dir = os.path.join(atlas_dir, version)
+    os.makedirs(os.path.join(settings.MEDIA_ROOT, version_dir), exist_ok=True)
+
+    with Image.open(image_paths[0]) as first:
+        source_size = first.size
+
+    indexes = list(range(1, len(image_paths) + 1))
+    levels = {}
+    for name, width in settings.ATLAS_LEVELS.items():
+        levels[name] = build_level(image_paths, indexes, level_size(source_size, width), version_dir, name)
+
+    manifest = {
+        'version': version,
+        'frame_count': len(image_paths),
+        'preview': next(iter(settings.ATLAS_LEVELS)),
+        'levels': levels,
+    }
+
+    manifest_path = get_atlas_manifest_path(stone.certificate)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    for entry in os.scandir(os.path.join(settings.MEDIA_ROOT, atlas_dir)):
+        if entry.is_dir() and entry.name != version:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    logger.info(f"Built atlas for {stone.certificate}, version {version}")
+    return manifest
+
+
+def read_atlas_manifest(certificate: str) -> dict | None:
+    try:
+        with open(get_atlas_manifest_path(certificate)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    for level in manifest['levels'].values():
+        for atlas in level['atlases']:
+            atlas['url'] = settings.MEDIA_URL + atlas['path']
+    return manifest
@@ -0,0 +1,98 @@
+import hashlib
+import logging
+import os
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import FrameBlob, Stone, get_blob_name, get_stone_folder_path
+from .storage import IMMUTABLE, delete_media, delete_media_folder, is_remote, local_path, media_exists, trim_local_cache, upload_file
+
+logger = logging.getLogger(__name__)
+
+
+def hash_frame(path: str) -> tuple[str, int]:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as frame_file:
+        for block in iter(lambda: frame_file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest(), os.path.getsize(path)
+
+
+def place_blob(path: str, blob: str):
+    # Identical content is stored once, later copies are dropped
+    name = get_blob_name(blob)
+    target = local_path(name)
+    if os.path.exists(target):
+        os.remove(path)
+        return
+    if is_remote():
+        # Uploaded before it appears locally, a local blob is always in the bucket
+        if not media_exists(name):
+            upload_file(path, name, cache_control=IMMUTABLE)
+        trim_local_cache()
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(path, target)
+
+
+def acquire_blobs(sizes: dict[str, int]):
+    """
+    Adds one reference per stone to each blob in `sizes` ({blob: size}).
+    References are taken before the files are placed: the sweeper holds the row
+    lock while it removes a file, so a blob referenced here is never swept after.
+    """
+    blobs = {blob.split('.', 1)[0]: blob for blob in sizes}
+    with transaction.atomic():
+        existing = set(FrameBlob.objects.select_for_update().filter(digest__in=blobs).values_list('digest', flat=True))
+        FrameBlob.objects.bulk_create(
+            [
+                FrameBlob(digest=digest, extension=blob.split('.', 1)[1], size=sizes[blob], refcount=0)
+                for digest, blob in blobs.items() if digest not in existing
+            ],
+            ignore_conflicts=True,
+        )
+        FrameBlob.objects.filter(digest__in=blobs).update(refcount=F('refcount') + 1)
+
+
+def release_blobs(blobs: list[str]) -> int:
+    digests = {blob.split('.', 1)[0] for blob in blobs}
+    FrameBlob.objects.filter(digest__in=digests).update(refcount=Greatest(F('refcount') - 1, 0))
+    return sweep_blobs(digests)
+
+
+def sweep_blobs(digests=None, limit: int = 10000) -> int:
+    candidates = FrameBlob.objects.filter(refcount=0)
+    if digests is not None:
+        candidates = candidates.filter(digest__in=digests)
+
+    removed = 0
+    for digest in list(candidates.values_list('digest', flat=True)[:limit]):
+        with transaction.atomic():
+            # Re-checked under the row lock, a parse may have referenced it since
+            blob = FrameBlob.objects.select_for_update().filter(digest=digest, refcount=0).first()
+            if blob is None:
+                continue
+            delete_media(get_blob_name(blob.blob))
+            blob.delete()
+            removed += 1
+    return removed
+
+
+@receiver(post_delete, sender=Stone)
+def delete_stone_files(sender, instance, **kwargs):
+    # Runs for queryset deletes too, Stone.delete() is not called for those
+    delete_media_folder(get_stone_folder_path(instance.certificate))
+
+    if instance.frames and 'blobs' in instance.frames:
+        # Released after the delete commits, a failed delete keeps its references
+        transaction.on_commit(lambda: release_stone_blobs(instance.certificate, instance.frames['blobs']))
+
+
+def release_stone_blobs(certificate: str, blobs: list[str]):
+    try:
+        removed = release_blobs(blobs)
+        logger.info(f"Released {len(set(blobs))} frame blobs of {certificate}, {removed} removed")
+    except Exception as e:
+        # Leftover references are fixed by migrate_frame_blobs --recount, unreferenced blobs go in the periodic sweep
+        logger.error(f"Error while releasing frame blobs of {certificate}: {e}")
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import psutil
+from contextlib import asynccontextmanager
+from pyppeteer import launch, connect
+from django.conf import settings
+from .metrics import BROWSER_RSS, stage_timer
+
+logger = logging.getLogger(__name__)
+
+
+LAUNCH_OPTIONS = {
+    'handleSIGINT': False,
+    'handleSIGTERM': False,
+    'handleSIGHUP': False,
+    'headless': True,
+    'executablePath': '/usr/bin/chromium',
+    'args': [
+        '--no-sandbox',
+        '--disable-setuid-sandbox',
+        '--disable-dev-shm-usage',
+        '--disable-gpu',
+        '--disable-popup-blocking',
+        '--no-zygote'
+    ],
+    'defaultViewport': None,
+}
+
+
+async def browser_launch(retries=3):
+    try:
+        for attempt in range(retries):
+            try:
+                browser = await launch(LAUNCH_OPTIONS)
+                logger.warning(f"Browser launched: {browser.wsEndpoint}")
+                return browser
+            except Exception as e:
+                logger.error(f"Error while launching browser (attempt {attempt+1}/{retries}): {e}")
+                if attempt + 1 == retries:
+                    raise
+                await asyncio.sleep(5)
+    except Exception as final_error:
+        logger.error(f"Failed to launch browser after {retries} attempts: {final_error}")
+        return None
+
+
+class BrowserPool:
+    """
+    Worker-scoped Chromium shared by every parse running in the process.
+
+    The Chromium process outlives a single event loop (each task runs its own
+    asyncio.run), so the pool keeps the process and its websocket endpoint and
+    reconnects when it is used from a new loop. Each lease gets a fresh
+    incognito context; at most `size` leases are open at once.
+    """
+
+    def __init__(self, size: int, max_pages: int, max_rss_mb: int, health_timeout: int = 10):
+        self.size = size
+        self.max_pages = max_pages
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.health_timeout = health_timeout
+
+        self._process = None
+        self._endpoint = None
+        self._browser = None
+        self._served = 0
+
+        self._loop = None
+        self._slots = None
+        self._state = None
+        self._active = 0
+        self._retiring = False
+
+    # Public function
+
+    @asynccontextmanager
+    async def lease(self):
+        self._bind_loop()
+        async with self._slots:
+            browser = await self._acquire()
+            context = None
+            try:
+                context = await browser.createIncognitoBrowserContext()
+                page = await context.newPage()
+                yield page
+            finally:
+                if context:
+                    try:
+                        await context.close()
+                    except Exception as e:
+                        logger.warning(f"Error while closing browser context: {e}")
+                await self._release()
+
+    def rss(self) -> int:
+        if not self._is_alive():
+            return 0
+        try:
+            process = psutil.Process(self._process.pid)
+            children = process.children(recursive=True)
+            return process.memory_info().rss + sum(child.memory_info().rss for child in children)
+        except psutil.NoSuchProcess:
+            return 0
+
+    def shutdown(self):
+        self._terminate()
+        self._browser = None
+        BROWSER_RSS.set(0)
+
+    # Lease helpers
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is self._loop:
+            return
+        # The previous connection and primitives belong to a closed loop
+        self._loop = loop
+        self._browser = None
+        self._slots = asyncio.Semaphore(self.size)
+        self._state = asyncio.Condition()
+        self._active = 0
+        self._retiring = False
+
+    async def _acquire(self):
+        async with self._state:
+            while self._retiring:
+                await self._state.wait()
+
+            if self._is_alive() and self._needs_recycle():
+                logger.warning(f"Recycling browser after {self._served} pages, rss {self.rss() // (1024 * 1024)}MB")
+                self._retiring = True
+                try:
+                    await self._state.wait_for(lambda: self._active == 0)
+                    await self._restart()
+                finally:
+                    self._retiring = False
+                    self._state.notify_all()
+
+            if not await self._healthy():
+                await self._restart()
+
+            self._active += 1
+            self._served += 1
+            BROWSER_RSS.set(self.rss())
+            return self._browser
+
+    async def _release(self):
+        async with self._state:
+            self._active -= 1
+            self._state.notify_all()
+
+    # Browser helpers
+
+    def _is_alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def _needs_recycle(self) -> bool:
+        return self._served >= self.max_pages or self.rss() >= self.max_rss
+
+    async def _healthy(self) -> bool:
+        if not self._is_alive():
+            if self._process is not None:
+                logger.error(f"Browser process {self._process.pid} is gone, relaunching")
+            return False
+
+        try:
+            if self._browser is None:
+                self._browser = await connect({'browserWSEndpoint': self._endpoint})
+            await asyncio.wait_for(self._browser.version(), self.health_timeout)
+            return True
+        except Exception as e:
+            logger.error(f"Browser health check failed: {e}")
+            return False
+
+    async def _restart(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._terminate)
+
+        with stage_timer('browser_launch'):
+            browser = await browser_launch()
+        if not browser:
+            raise Exception("Browser not launched")
+
+        self._browser = browser
+        self._process = browser.process
+        self._endpoint = browser.wsEndpoint
+        self._served = 0
+
+    def _terminate(self):
+        if not self._is_alive():
+            self._process = None
+            return
+        try:
+            process = psutil.Process(self._process.pid)
+            processes = process.children(recursive=True) + [process]
+            for proc in processes:
+                proc.terminate()
+            gone, alive = psutil.wait_procs(processes, timeout=5)
+            for proc in alive:
+                proc.kill()
+            logger.info(f"Browser process {self._process.pid} terminated")
+        except psutil.NoSuchProcess:
+            pass
+        except Exception as e:
+            logger.error(f"Error while terminating browser process {self._process.pid}: {e}")
+        self._process = None
+
+
+browser_pool = BrowserPool(
+    size=settings.PARSER_BROWSER_POOL_SIZE,
+    max_pages=settings.PARSER_BROWSER_MAX_PAGES,
+    max_rss_mb=settings.PARSER_BROWSER_MAX_RSS_MB,
+)
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import struct
+from django.conf import settings
+from .chunk_process import chunk_count, chunk_key_points
+from .models import get_stone_folder_path, is_blob_name
+
+logger = logging.getLogger(__name__)
+
+# Chunk bundle: frames packed back to back, each as
+# uint32 big-endian frame index, uint32 big-endian length, raw image bytes
+FRAME_HEADER = struct.Struct('>II')
+
+
+def get_bundles_folder_path(certificate: str):
+    return os.path.join(get_stone_folder_path(certificate), 'bundles')
+
+
+def get_manifest_path(bundles_dir: str):
+    return os.path.join(settings.MEDIA_ROOT, bundles_dir, 'manifest.json')
+
+
+def frames_version(image_paths: list[str]) -> str:
+    digest = hashlib.sha1()
+    for path in image_paths:
+        if is_blob_name(path):
+            # Content-addressed, the name changes with the content and is the same on every host
+            digest.update(f'{os.path.basename(path)}\n'.encode())
+            continue
+        stat = os.stat(path)
+        digest.update(f'{path}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()[:12]
+
+
+def build_chunk_bundles(stone) -> dict:
+    image_paths = stone.frame_paths()
+    if not image_paths:
+        raise ValueError(f"No images found for stone: {stone.certificate}")
+
+    manifest = write_bundles(image_paths, get_bundles_folder_path(stone.certificate))
+    logger.info(f"Built {manifest['total_chunks']} chunk bundles for {stone.certificate}, version {manifest['version']}")
+    return manifest
+
+
+def write_bundles(image_paths: list[str], bundles_dir: str) -> dict:
+    version = frames_version(image_paths)
+    version_dir = os.path.join(bundles_dir, version)
+    os.makedirs(os.path.join(settings.MEDIA_ROOT, version_dir), exist_ok=True)
+
+    total_images = len(image_paths)
+    chunks = []
+    for index in range(chunk_count(total_images)):
+        key_points = chunk_key_points(total_images, index)
+        path = os.path.join(version_dir, f'chunk_{index}.bin')
+        with open(os.path.join(settings.MEDIA_ROOT, path), 'wb') as bundle:
+            for key_point in key_points:
+                with open(image_paths[key_point], 'rb') as image_file:
+                    content = image_file.read()
+                bundle.write(FRAME_HEADER.pack(key_point + 1, len(content)))
+                bundle.write(content)
+        chunks.append({'chunk_index': index, 'path': path, 'key_points': key_points})
+
+    manifest = {
+        'version': version,
+        'total_images': total_images,
+        'total_chunks': len(chunks),
+        'chunks': chunks,
+    }
+
+    # Write the manifest last so it never points to a half-written version
+    manifest_path = get_manifest_path(bundles_dir)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    for entry in os.scandir(os.path.join(settings.MEDIA_ROOT, bundles_dir)):
+        if entry.is_dir() and entry.name != version:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    return manifest
+
+
+def read_manifest(bundles_dir: str) -> dict | None:
+    try:
+        with open(get_manifest_path(bundles_dir)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    for chunk in manifest['chunks']:
+        chunk['url'] = settings.MEDIA_URL + chunk['path']
+    return manifest
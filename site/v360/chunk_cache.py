@@ -0,0 +1,89 @@
+import json
+import logging
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .metrics import CHUNK_CACHE
+from .models import Stone
+from .video_cache import stone_fingerprint
+
+logger = logging.getLogger(__name__)
+
+chunk_cache = caches['chunks']
+
+
+def version_key(certificate: str) -> str:
+    return f'v360:chunks:version:{certificate}'
+
+
+def chunk_key(certificate: str, version: str, variant: str, index) -> str:
+    return f'v360:chunks:{certificate}:{version}:{variant}:{index}'
+
+
+def chunk_variant(derivative: tuple | None) -> str:
+    # Keyed by the size served, all viewport widths picking the same one share the entries
+    if derivative:
+        _, size, extension = derivative
+        return f'{size}.{extension}'
+    return 'source'
+
+
+def encode_chunk(chunk: dict) -> bytes:
+    # Same compact form as the API renderer, hits and misses return identical bytes
+    return json.dumps(chunk, separators=(',', ':')).encode()
+
+
+def get_cached_chunk(certificate: str, variant: str, index) -> tuple[str | None, bytes | None]:
+    """
+    Current version of the stone and its encoded chunk. A hit costs two cache
+    reads, neither the database nor the frame files are touched.
+    """
+    try:
+        version = chunk_cache.get(version_key(certificate))
+        content = chunk_cache.get(chunk_key(certificate, version, variant, index)) if version else None
+    except Exception as e:
+        # Served without the cache while it is unavailable
+        logger.warning(f"Error while reading chunk {index} of {certificate} from the cache: {e}")
+        return None, None
+    CHUNK_CACHE.labels('hit' if content is not None else 'miss').inc()
+    return version, content
+
+
+def ensure_chunk_version(stone):
+    """
+    Starts a new version for the stone: its frame-set version and a random part.
+    Chunks are only stored under a version read before the stone was loaded,
+    after an invalidation no request can store older frames under the new one.
+    """
+    fingerprint = stone_fingerprint(stone)
+    if not fingerprint:
+        return
+    try:
+        chunk_cache.add(version_key(stone.certificate), f'{fingerprint}.{uuid.uuid4().hex[:8]}', None)
+    except Exception as e:
+        logger.warning(f"Error while starting the chunk cache version of {stone.certificate}: {e}")
+
+
+def store_chunk(certificate: str, version: str, variant: str, index, content: bytes):
+    if len(content) > settings.CHUNK_CACHE_MAX_ITEM_KB * 1024:
+        return
+    try:
+        chunk_cache.set(chunk_key(certificate, version, variant, index), content)
+    except Exception as e:
+        logger.warning(f"Error while caching chunk {index} of {certificate}: {e}")
+
+
+def invalidate_chunks(certificate: str):
+    # Chunks of the old version are no longer reachable and expire with their TTL.
+    # Called when the frames or the derivatives of a stone change
+    try:
+        chunk_cache.delete(version_key(certificate))
+    except Exception as e:
+        logger.warning(f"Error while invalidating cached chunks of {certificate}: {e}")
+
+
+@receiver(post_delete, sender=Stone)
+def invalidate_deleted_stone(sender, instance, **kwargs):
+    invalidate_chunks(instance.certificate)
@@ -0,0 +1,69 @@
+import asyncio
+
+POLL_INTERVAL = 0.5
+
+# v360 pages keep the decoded frames in a global `frames` variable
+V360_FRAMES_STATE = """() => {
+    if (typeof frames === 'undefined' || !frames || !frames[0]) {
+        return 0;
+    }
+    return frames[0].filter(Boolean).length;
+}"""
+
+
+class FrameCollector:
+    """
+    Tracks the frame indexes sniffed from page responses and tells when the set is complete.
+
+    The set is complete once `expected` frames arrived or, when `quiet` is given
+    to wait(), once the collected indexes form a gapless range and nothing new
+    arrived for `quiet` seconds.
+    """
+
+    def __init__(self, expected: int | None = None):
+        self.indexes = set()
+        self.expected = expected
+        self._loop = asyncio.get_running_loop()
+        self._complete = self._loop.create_future()
+        self._updated_at = self._loop.time()
+
+    def add(self, index: int) -> bool:
+        if index in self.indexes:
+            return False
+        self.indexes.add(index)
+        self._updated_at = self._loop.time()
+        if self.expected and len(self.indexes) >= self.expected and not self._complete.done():
+            self._complete.set_result(True)
+        return True
+
+    def is_contiguous(self) -> bool:
+        if not self.indexes:
+            return False
+        return max(self.indexes) - min(self.indexes) + 1 == len(self.indexes)
+
+    async def wait(self, timeout: float, quiet: float | None = None) -> int:
+        deadline = self._loop.time() + timeout
+        while not self._complete.done():
+            now = self._loop.time()
+            if now >= deadline:
+                break
+            if quiet and self.is_contiguous() and now - self._updated_at >= quiet:
+                break
+            await asyncio.wait({self._complete}, timeout=min(deadline - now, POLL_INTERVAL))
+        return len(self.indexes)
+
+
+async def wait_for_v360_frames(page, timeout: float, quiet: float) -> int:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    loaded, changed_at = -1, loop.time()
+
+    while loop.time() < deadline:
+        current = await page.evaluate(V360_FRAMES_STATE)
+        if current != loaded:
+            loaded, changed_at = current, loop.time()
+        elif loaded > 0 and loop.time() - changed_at >= quiet:
+            return loaded
+        await asyncio.sleep(POLL_INTERVAL)
+
+    return max(loaded, 0)
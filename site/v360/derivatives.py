@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import shutil
+from PIL import Image
+from django.conf import settings
+from .bundles import frames_version, write_bundles
+from .frame_writer import frame_executor
+from .models import get_stone_folder_path
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpeg'}
+
+
+def get_derivatives_folder_path(certificate: str):
+    return os.path.join(get_stone_folder_path(certificate), 'derivatives')
+
+
+def get_derivatives_manifest_path(certificate: str):
+    return os.path.join(settings.MEDIA_ROOT, get_derivatives_folder_path(certificate), 'derivatives.json')
+
+
+def pick_size(sizes: list[int], requested: int) -> int | None:
+    # Smallest variant that still covers the requested width, None means the original
+    fitting = [size for size in sizes if size >= requested]
+    return min(fitting) if fitting else None
+
+
+def write_derivatives(path: str, version_dir: str, name: str):
+    with Image.open(path) as image:
+        image = image.convert('RGB')
+        width, height = image.size
+        for size in settings.DERIVATIVE_SIZES:
+            variant = image
+            if size < width:
+                variant = image.resize((size, max(round(height * size / width), 1)), Image.Resampling.LANCZOS)
+            for image_format in settings.DERIVATIVE_FORMATS:
+                extension = DERIVATIVE_EXTENSIONS[image_format]
+                variant.save(
+                    os.path.join(settings.MEDIA_ROOT, version_dir, str(size), f'{name}.{extension}'),
+                    image_format,
+                    quality=settings.DERIVATIVE_QUALITY,
+                )
+
+
+def build_stone_derivatives(stone) -> dict:
+    image_paths = stone.frame_paths()
+    if not image_paths:
+        raise ValueError(f"No images found for stone: {stone.certificate}")
+
+    version = frames_version(image_paths)
+    derivatives_dir = get_derivatives_folder_path(stone.certificate)
+    version_dir = os.path.join(derivatives_dir, version)
+    for size in settings.DERIVATIVE_SIZES:
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, version_dir, str(size)), exist_ok=True)
+
+    # Named by position, the source frames may be content-addressed blobs
+    names = [f'image_{index}' for index in range(1, len(image_paths) + 1)]
+    list(frame_executor.map(write_derivatives, image_paths, [version_dir] * len(names), names))
+
+    # Viewer bundles per size, in the first (preferred) format
+    extension = DERIVATIVE_EXTENSIONS[settings.DERIVATIVE_FORMATS[0]]
+    for size in settings.DERIVATIVE_SIZES:
+        size_dir = os.path.join(version_dir, str(size))
+        paths = [os.path.join(settings.MEDIA_ROOT, size_dir, f'{name}.{extension}') for name in names]
+        write_bundles(paths, os.path.join(size_dir, 'bundles'))
+
+    manifest = {
+        'version': version,
+        'folder': version_dir,
+        'sizes': list(settings.DERIVATIVE_SIZES),
+        'formats': [DERIVATIVE_EXTENSIONS[image_format] for image_format in settings.DERIVATIVE_FORMATS],
+        'frames': names,
+    }
+
+    manifest_path = get_derivatives_manifest_path(stone.certificate)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    for entry in os.scandir(os.path.join(settings.MEDIA_ROOT, derivatives_dir)):
+        if entry.is_dir() and entry.name != version:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    logger.info(f"Built derivatives for {stone.certificate}, version {version}")
+    return manifest
+
+
+def read_derivatives_manifest(certificate: str) -> dict | None:
+    try:
+        with open(get_derivatives_manifest_path(certificate)) as manifest_file:
+            return json.load(manifest_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def derivative_folder(certificate: str, resolution: int) -> str | None:
+    manifest = read_derivatives_manifest(certificate)
+    if not manifest:
+        return None
+    size = pick_size(manifest['sizes'], resolution)
+    if size is None:
+        return None
+    return os.path.join(manifest['folder'], str(size))
+
+
+def pick_derivative(certificate: str, resolution: int, extension: str | None = None) -> tuple[dict, int, str] | None:
+    # Manifest, size and format served for a requested width, None means the originals
+    manifest = read_derivatives_manifest(certificate)
+    if not manifest:
+        return None
+    size = pick_size(manifest['sizes'], resolution)
+    if size is None:
+        return None
+    if extension not in manifest['formats']:
+        extension = manifest['formats'][0]
+    return manifest, size, extension
+
+
+def derivative_paths(manifest: dict, size: int, extension: str) -> list[str]:
+    size_dir = os.path.join(settings.MEDIA_ROOT, manifest['folder'], str(size))
+    return [os.path.join(size_dir, f'{name}.{extension}') for name in manifest['frames']]
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .metrics import observe_stage
+from .models import ParseEvent
+
+logger = logging.getLogger(__name__)
+
+_buffer = []
+_buffer_lock = threading.Lock()
+
+
+def record_event(certificate: str, stage: str, outcome: str, duration: float | None = None, error=''):
+    # Appending is the only work on the parse path, rows are inserted in batches
+    event = ParseEvent(
+        certificate=certificate,
+        stage=stage,
+        outcome=outcome,
+        duration=duration,
+        error=str(error)[:2000],
+        created_at=timezone.now(),
+    )
+    with _buffer_lock:
+        _buffer.append(event)
+        full = len(_buffer) >= settings.PARSE_EVENTS_BATCH_SIZE
+
+    if full and not _in_event_loop():
+        flush_events()
+
+
+def flush_events():
+    with _buffer_lock:
+        events = _buffer[:]
+        _buffer.clear()
+    if not events:
+        return
+    try:
+        ParseEvent.objects.bulk_create(events)
+    except Exception as e:
+        logger.error(f"Error while writing {len(events)} parse events: {e}")
+
+
+@contextmanager
+def timed_event(certificate: str, stage: str):
+    # The same timing goes to the stone's event log and to the stage histogram
+    started = time.monotonic()
+    try:
+        yield
+    except BaseException as e:
+        duration = time.monotonic() - started
+        record_event(certificate, stage, ParseEvent.FAILED, duration, e)
+        observe_stage(stage, duration, failed=True)
+        raise
+    duration = time.monotonic() - started
+    record_event(certificate, stage, ParseEvent.SUCCEEDED, duration)
+    observe_stage(stage, duration)
+
+
+def prune_events(batch_size: int = 10000) -> int:
+    # Deleted in primary key batches, a single DELETE over a large table locks it for too long
+    cutoff = timezone.now() - timedelta(days=settings.PARSE_EVENTS_RETENTION_DAYS)
+    deleted = 0
+    while True:
+        ids = list(ParseEvent.objects.filter(created_at__lt=cutoff).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += ParseEvent.objects.filter(id__in=ids).delete()[0]
+
+
+# Helper functions
+
+def _in_event_loop() -> bool:
+    # The ORM can't be used from a running loop, the buffer is flushed when the task ends
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import random
+import re
+import httpx
+from urllib.parse import urlsplit
+from django.conf import settings
+from .browser_pool import browser_pool
+from .host_limiter import host_limiter
+from .metrics import BYTES_DOWNLOADED, stage_timer
+
+logger = logging.getLogger(__name__)
+
+
+class FrameTemplate:
+    """
+    Numbered frame URL, e.g. https://host/stone/001.jpg?v=2 -> https://host/stone/{index}.jpg?v=2
+    """
+
+    def __init__(self, url: str):
+        base, separator, query = url.partition('?')
+        head, _, filename = base.rpartition('/')
+        match = re.match(r'^(\d+)(.*)$', filename)
+        if not match:
+            raise ValueError(f"Frame URL is not numbered: {url}")
+
+        digits = match.group(1)
+        self.prefix = head + '/'
+        self.suffix = match.group(2) + separator + query
+        self.width = len(digits) if digits.startswith('0') else 0
+        self.index = int(digits)
+
+    def url(self, index: int) -> str:
+        return f"{self.prefix}{str(index).zfill(self.width)}{self.suffix}"
+
+
+class FrameFetcher:
+    """
+    Browserless frame downloads over a pooled keep-alive HTTP client.
+
+    The browser is only used once per stone to discover a frame URL, the rest
+    of the frames are requested directly with bounded concurrency.
+    """
+
+    def __init__(self, concurrency: int, retries: int, timeout: float):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+        self._loop = None
+        self._http = None
+
+    # Public function
+
+    async def discover(self, page_url: str, matcher, timeout: float = 30) -> str:
+        async with browser_pool.lease() as page:
+            found = asyncio.get_running_loop().create_future()
+
+            def on_response(response):
+                if not found.done() and matcher(response):
+                    found.set_result(response.url)
+
+            page.on('response', on_response)
+            async with host_limiter.limit(page_url, kind='page'):
+                await page.goto(page_url, waitUntil='domcontentloaded', timeout=60000)
+            return await asyncio.wait_for(found, timeout)
+
+    async def get(self, url: str) -> bytes | None:
+        client = self._client()
+        for attempt in range(self.retries):
+            try:
+                # Throttling and server errors count against the host, a missing frame does not
+                async with host_limiter.limit(url):
+                    with stage_timer('http_get'):
+                        response = await client.get(url)
+                    if response.status_code == 429 or response.status_code >= 500:
+                        response.raise_for_status()
+                if response.status_code == 404:
+                    return None
+                response.raise_for_status()
+                BYTES_DOWNLOADED.labels(urlsplit(url).hostname or '').inc(len(response.content))
+                return response.content
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500 and e.response.status_code != 429:
+                    raise
+                if attempt + 1 == self.retries:
+                    raise
+                logger.warning(f"Error while fetching {url} (attempt {attempt+1}/{self.retries}): {e}")
+                await asyncio.sleep(2 ** attempt + random.random())
+
+    async def fetch_range(self, template: FrameTemplate, indexes, on_frame) -> set[int]:
+        # Frames are handed to on_frame as they arrive instead of being collected
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_one(index):
+            async with semaphore:
+                content = await self.get(template.url(index))
+            if content is None:
+                return None
+            await on_frame(index, content)
+            return index
+
+        results = await asyncio.gather(*(fetch_one(index) for index in indexes))
+        return {index for index in results if index is not None}
+
+    async def fetch_until_missing(self, template: FrameTemplate, start: int, on_frame) -> set[int]:
+        fetched = set()
+        while True:
+            window = range(start, start + self.concurrency)
+            fetched |= await self.fetch_range(template, window, on_frame)
+            if window[-1] not in fetched:
+                return fetched
+            start += self.concurrency
+
+    async def aclose(self):
+        # Called before the task's loop closes, its sockets would leak with it
+        if self._http is not None and self._loop is asyncio.get_running_loop():
+            await self._http.aclose()
+        self._http = self._loop = None
+
+    # Helper functions
+
+    def _client(self) -> httpx.AsyncClient:
+        # The client's connection pool is bound to the loop it was created on
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._http = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            )
+        return self._http
+
+
+frame_fetcher = FrameFetcher(
+    concurrency=settings.PARSER_FETCH_CONCURRENCY,
+    retries=settings.PARSER_FETCH_RETRIES,
+    timeout=settings.PARSER_FETCH_TIMEOUT,
+)
@@ -0,0 +1,74 @@
+import os
+import re
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+CHUNK_SIZE = 64 * 1024
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def read_range(path: str, start: int, length: int):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    # Only a single range is supported, anything else falls back to the full file
+    match = RANGE_HEADER.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if not start:
+        # Suffix range: the last N bytes
+        return max(size - int(end), 0), size - 1
+    return int(start), min(int(end), size - 1) if end else size - 1
+
+
+def serve_file(request, path: str, content_type: str, filename: str, etag: str, accel_path: str | None = None):
+    """
+    Streams a file with support for Range, If-Range, If-None-Match and
+    If-Modified-Since. With accel_path the transfer is left to nginx.
+    """
+    if accel_path:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = accel_path
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    stat = os.stat(path)
+    etag = quote_etag(etag)
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is not None:
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        byte_range = parse_range(request.META['HTTP_RANGE'], size)
+
+    if byte_range:
+        start, end = byte_range
+        if start > end or start >= size:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        response = StreamingHttpResponse(read_range(path, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = StreamingHttpResponse(read_range(path, 0, size), content_type=content_type)
+        response['Content-Length'] = str(size)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
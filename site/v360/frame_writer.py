@@ -0,0 +1,173 @@
+import asyncio
+import base64
+import io
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from PIL import Image
+from django.conf import settings
+from .blobs import acquire_blobs, hash_frame, place_blob, release_blobs
+from .chunk_cache import invalidate_chunks
+from .metrics import stage_timer
+from .models import Stone, get_stone_folder_path
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FRAME = re.compile(r'^frame_(\d+)\.(jpeg|png|webp)$')
+
+# Shared by every parse in the worker process, decoding never runs on the event loop
+frame_executor = ThreadPoolExecutor(max_workers=settings.PARSER_WRITE_WORKERS, thread_name_prefix='frame-writer')
+
+
+def decode_frame(data) -> bytes:
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data)
+    # Data URL (data:image/jpeg;base64,...) or bare base64
+    return base64.b64decode(data.split(',', 1)[-1])
+
+
+def sniff_format(content: bytes) -> str | None:
+    if content.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if content.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if content[:4] == b'RIFF' and content[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def write_frame(media_dir: str, key: int, data) -> str:
+    with stage_timer('frame_decode'):
+        content = decode_frame(data)
+        extension = sniff_format(content)
+
+    # Written under a temporary name, a frame file that exists is complete and survives as a checkpoint
+    tmp_path = os.path.join(media_dir, f'frame_{key}.tmp')
+    if extension:
+        # Already a format the viewer can show, write the original bytes
+        with stage_timer('frame_write'), open(tmp_path, 'wb') as frame_file:
+            frame_file.write(content)
+    else:
+        with stage_timer('frame_encode'), Image.open(io.BytesIO(content)) as image:
+            extension = 'jpeg'
+            image.convert('RGB').save(tmp_path, 'JPEG', quality=95)
+    os.replace(tmp_path, os.path.join(media_dir, f'frame_{key}.{extension}'))
+    return extension
+
+
+def frame_size(path: str) -> tuple[int, int]:
+    # Only the header is read
+    with Image.open(path) as image:
+        return image.size
+
+
+def read_checkpoint(media_dir: str) -> dict[int, str]:
+    checkpoint = {}
+    for entry in os.scandir(media_dir):
+        match = CHECKPOINT_FRAME.match(entry.name)
+        if match:
+            checkpoint[int(match.group(1))] = match.group(2)
+    return checkpoint
+
+
+def clear_checkpoint(certificate: str):
+    media_dir = os.path.join(settings.MEDIA_ROOT, get_stone_folder_path(certificate))
+    if not os.path.isdir(media_dir):
+        return
+    for entry in os.scandir(media_dir):
+        if CHECKPOINT_FRAME.match(entry.name) or entry.name.endswith('.tmp'):
+            os.remove(entry.path)
+
+
+class FrameWriter:
+    """
+    Writes frames to the stone folder as they arrive.
+
+    submit() hands decoding and writing to the shared thread pool, with at most
+    PARSER_WRITE_QUEUE frames in flight. finish() waits for them, moves the
+    files to the content-addressed blob store in source order and stores the
+    frame manifest on the stone. Frames left in the folder by an interrupted
+    attempt are picked up and not written again.
+    """
+
+    def __init__(self, stone):
+        self.stone = stone
+        self.save_dir = get_stone_folder_path(stone.certificate)
+        self.media_dir = os.path.join(settings.MEDIA_ROOT, self.save_dir)
+        os.makedirs(self.media_dir, exist_ok=True)
+
+        self._checkpoint = read_checkpoint(self.media_dir)
+        self._pending = {}
+        self._slots = asyncio.Semaphore(settings.PARSER_WRITE_QUEUE)
+
+    def __len__(self):
+        return len(self._checkpoint) + len(self._pending)
+
+    def __contains__(self, key: int):
+        return key in self._checkpoint or key in self._pending
+
+    async def submit(self, key: int, data):
+        if key in self:
+            return
+        # Reserved before waiting for a slot, a repeated submit of the frame must not write the same file
+        loop = asyncio.get_running_loop()
+        written = self._pending[key] = loop.create_future()
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            del self._pending[key]
+            written.cancel()
+            raise
+        future = loop.run_in_executor(frame_executor, write_frame, self.media_dir, key, data)
+        future.add_done_callback(lambda done: self._written(written, done))
+
+    def _written(self, written, done):
+        self._slots.release()
+        if done.cancelled():
+            written.cancel()
+        elif done.exception() is not None:
+            written.set_exception(done.exception())
+        else:
+            written.set_result(done.result())
+
+    async def finish(self, limit: int | None = None) -> int:
+        pending = sorted(self._pending)
+        results = await asyncio.gather(*(self._pending[key] for key in pending), return_exceptions=True)
+        extensions = {**self._checkpoint, **dict(zip(pending, results))}
+
+        frames = []
+        for key, extension in sorted(extensions.items()):
+            if isinstance(extension, Exception):
+                logger.error(f"Error while writing frame {key} for {self.stone.certificate}: {extension}")
+                continue
+            frames.append(os.path.join(self.media_dir, f'frame_{key}.{extension}'))
+
+        if limit is not None and len(frames) > limit:
+            # Frames past the vendor's set, e.g. a repeat of the first one, are dropped in source order
+            for path in frames[limit:]:
+                os.remove(path)
+            frames = frames[:limit]
+
+        loop = asyncio.get_running_loop()
+        width = height = None
+        blobs = []
+        if frames:
+            width, height = await loop.run_in_executor(frame_executor, frame_size, frames[0])
+            with stage_timer('frame_hash'):
+                hashes = await asyncio.gather(*(loop.run_in_executor(frame_executor, hash_frame, path) for path in frames))
+            blobs = [f'{digest}.{path.rsplit(".", 1)[1]}' for path, (digest, _) in zip(frames, hashes)]
+
+            # References first, a blob is never swept between placing it and storing the manifest
+            await sync_to_async(acquire_blobs)({blob: size for blob, (_, size) in zip(blobs, hashes)})
+            await asyncio.gather(*(loop.run_in_executor(frame_executor, place_blob, path, blob) for path, blob in zip(frames, blobs)))
+
+        previous = (self.stone.frames or {}).get('blobs')
+        self.stone.frames = {'count': len(blobs), 'width': width, 'height': height, 'blobs': blobs}
+        self.stone.image_count = len(blobs)
+        await sync_to_async(Stone.objects.filter(pk=self.stone.pk).update)(frames=self.stone.frames, image_count=self.stone.image_count)
+        await sync_to_async(invalidate_chunks)(self.stone.certificate)
+        if previous:
+            await sync_to_async(release_blobs)(previous)
+        return len(blobs)
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+import redis.asyncio as redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Shared by all workers, the clock is taken from Redis so worker clocks don't matter.
+# The wait is returned as a string, Lua numbers are truncated to integers on return
+TOKEN_BUCKET = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+EWMA_WEIGHT = 0.2
+
+
+class HostController:
+    """
+    AIMD concurrency limit for one host within a worker: the limit grows by one
+    per round of successful requests and is halved when latency or errors rise.
+    """
+
+    def __init__(self, host: str, initial: int, minimum: int, maximum: int, latency_factor: float, error_rate: float):
+        self.host = host
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_factor = latency_factor
+        self.max_error_rate = error_rate
+
+        self.in_flight = 0
+        self.latency = None
+        self.baseline = None
+        self.error_rate = 0.0
+        self._last_decrease = 0.0
+        self._loop = None
+        self._condition = None
+
+    async def acquire(self):
+        self._bind_loop()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency: float, failed: bool):
+        self.record(latency, failed)
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def record(self, latency: float, failed: bool):
+        self.error_rate = EWMA_WEIGHT * failed + (1 - EWMA_WEIGHT) * self.error_rate
+        if not failed:
+            self.latency = latency if self.latency is None else EWMA_WEIGHT * latency + (1 - EWMA_WEIGHT) * self.latency
+            # The baseline drifts up slowly so a host that got slower for good is not throttled forever
+            self.baseline = latency if self.baseline is None else min(latency, self.baseline * 1.01)
+
+        slow = self.latency is not None and self.latency > self.baseline * self.latency_factor
+        if self.error_rate > self.max_error_rate or slow:
+            # One decrease per round trip, a burst of failures from one round halves the limit once
+            now = time.monotonic()
+            if now - self._last_decrease > (self.latency or 1):
+                self._last_decrease = now
+                self.limit = max(self.minimum, self.limit / 2)
+                logger.warning(f"Concurrency for {self.host} decreased to {int(self.limit)} "
+                               f"(latency {self.latency or 0:.2f}s, errors {self.error_rate:.0%})")
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    # Helper functions
+
+    def _bind_loop(self):
+        # Celery tasks run each stone in a new event loop, the learned limit is kept
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._condition = asyncio.Condition()
+            self.in_flight = 0
+
+
+class HostLimiter:
+    """
+    Per-host limits for vendor requests: a token bucket in Redis caps the request
+    rate across all workers, an AIMD controller caps concurrency in this worker.
+    """
+
+    def __init__(self, rate: float, burst: int, overrides: dict, initial: int, minimum: int, maximum: int,
+                 latency_factor: float, error_rate: float):
+        self.rate = rate
+        self.burst = burst
+        self.overrides = overrides
+        self.controller_options = {
+            'initial': initial,
+            'minimum': minimum,
+            'maximum': maximum,
+            'latency_factor': latency_factor,
+            'error_rate': error_rate,
+        }
+        self._controllers = {}
+        self._loop = None
+        self._redis = None
+        self._script = None
+
+    # Public function
+
+    @asynccontextmanager
+    async def limit(self, url: str, kind: str = 'fetch'):
+        # Page navigations and single frame requests have different latencies, they are tuned apart
+        host = urlsplit(url).hostname or ''
+        controller = self._controller(host, kind)
+        await controller.acquire()
+        failed = False
+        started = time.monotonic()
+        try:
+            await self._take_token(host)
+            started = time.monotonic()
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            await controller.release(time.monotonic() - started, failed)
+
+    async def aclose(self):
+        # Called before the task's loop closes, its connections would leak with it
+        if self._redis is not None and self._loop is asyncio.get_running_loop():
+            await self._redis.aclose()
+        self._redis = self._script = self._loop = None
+
+    # Helper functions
+
+    def _controller(self, host: str, kind: str) -> HostController:
+        key = (host, kind)
+        if key not in self._controllers:
+            self._controllers[key] = HostController(host, **self.controller_options)
+        return self._controllers[key]
+
+    async def _take_token(self, host: str):
+        rate, burst = self._bucket(host)
+        while True:
+            try:
+                wait = float(await self._token_script()(keys=[f'v360:ratelimit:{host}'], args=[rate, burst]))
+            except Exception as e:
+                # Parsing goes on unthrottled rather than failing when Redis is away
+                logger.warning(f"Rate limiter unavailable for {host}: {e}")
+                return
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def _bucket(self, host: str) -> tuple[float, int]:
+        # Overrides match the host and its parent domains, e.g. v360.in covers www.v360.in
+        labels = host.split('.')
+        for index in range(len(labels) - 1):
+            override = self.overrides.get('.'.join(labels[index:]))
+            if override:
+                return override.get('rate', self.rate), override.get('burst', self.burst)
+        return self.rate, self.burst
+
+    def _token_script(self):
+        # The Redis connection pool is bound to the loop it was created on
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._redis = redis.from_url(settings.CACHES['default']['LOCATION'])
+            self._script = self._redis.register_script(TOKEN_BUCKET)
+        return self._script
+
+
+host_limiter = HostLimiter(
+    rate=settings.PARSER_HOST_RATE,
+    burst=settings.PARSER_HOST_BURST,
+    overrides=settings.PARSER_HOST_RATE_OVERRIDES,
+    initial=settings.PARSER_HOST_CONCURRENCY,
+    minimum=settings.PARSER_HOST_CONCURRENCY_MIN,
+    maximum=settings.PARSER_HOST_CONCURRENCY_MAX,
+    latency_factor=settings.PARSER_HOST_LATENCY_FACTOR,
+    error_rate=settings.PARSER_HOST_ERROR_RATE,
+)
@@ -0,0 +1,80 @@
+import logging
+import uuid
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import StoneParseState
+from .parse_state import get_states, set_queued
+from .tasks import make_queue
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_diamonds(diamonds) -> tuple[list[dict], int, int]:
+    # The last entry wins for a certificate submitted twice in one batch
+    normalized = {}
+    invalid = 0
+    received = 0
+    for diamond in diamonds if isinstance(diamonds, list) else []:
+        received += 1
+        if not isinstance(diamond, dict):
+            invalid += 1
+            continue
+        source = str(diamond.get('source') or '').strip()
+        certificate = str(diamond.get('certificate') or '').strip()
+        if not source or not certificate:
+            invalid += 1
+            continue
+        normalized[certificate] = {'source': source, 'certificate': certificate, 'vendor': diamond.get('vendor')}
+
+    duplicates = received - invalid - len(normalized)
+    return list(normalized.values()), invalid, duplicates
+
+
+def is_in_flight(state: dict, now: datetime) -> bool:
+    if state['state'] not in (StoneParseState.QUEUED, StoneParseState.RUNNING):
+        return False
+    # A task lost with its worker leaves the state behind, it is parsed again after the window
+    since = state['started_at'] or state['queued_at']
+    if not since:
+        return True
+    return now - datetime.fromisoformat(since) < timedelta(seconds=settings.PARSER_IN_FLIGHT_SECONDS)
+
+
+def is_complete(state: dict) -> bool:
+    # A stone saved with part of its frames is parsed again
+    return state['state'] == StoneParseState.SUCCEEDED and (state['image_count'] or 0) >= settings.PARSER_COMPLETE_FRAMES
+
+
+def ingest_diamonds(diamonds) -> dict:
+    diamonds, invalid, duplicates = normalize_diamonds(diamonds)
+    states = get_states([diamond['certificate'] for diamond in diamonds])
+
+    now = timezone.now()
+    pending = []
+    parsed = in_flight = 0
+    for diamond in diamonds:
+        state = states.get(diamond['certificate'])
+        if state and is_complete(state):
+            parsed += 1
+        elif state and is_in_flight(state, now):
+            in_flight += 1
+        else:
+            pending.append(diamond)
+
+    batch_id = uuid.uuid4().hex
+    if pending:
+        # Marked before dispatch, a re-submission of the same feed skips them right away
+        set_queued([diamond['certificate'] for diamond in pending])
+        make_queue.delay(pending, batch_id)
+
+    counts = {
+        'received': len(diamonds) + invalid + duplicates,
+        'invalid': invalid,
+        'duplicates': duplicates,
+        'parsed': parsed,
+        'in_flight': in_flight,
+        'queued': len(pending),
+    }
+    logger.info(f"Ingested batch {batch_id}: {counts}")
+    return {'batch_id': batch_id, **counts}
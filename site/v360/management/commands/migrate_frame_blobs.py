@@ -0,0 +1,72 @@
+import os
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from v360.blobs import acquire_blobs, hash_frame, place_blob
+from v360.models import FrameBlob, Stone, get_frame_names
+
+
+class Command(BaseCommand):
+    help = 'Moves the frames of stones with a folder manifest to the blob store, or recounts blob references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--recount', action='store_true', help='Recount blob references from the stone manifests, run with the workers stopped')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.recount(options['batch_size'])
+        else:
+            self.migrate(options['batch_size'])
+
+    def migrate(self, batch_size):
+        # Stones without a manifest are moved by migrate_frame_manifests first
+        migrated = failed = 0
+        last_pk = 0
+
+        while True:
+            stones = list(Stone.objects.filter(pk__gt=last_pk, frames__isnull=False).exclude(frames__has_key='blobs').order_by('pk')[:batch_size])
+            if not stones:
+                break
+            last_pk = stones[-1].pk
+
+            for stone in stones:
+                paths = [os.path.join(settings.MEDIA_ROOT, name) for name in get_frame_names(stone.frames)]
+                try:
+                    hashes = [hash_frame(path) for path in paths]
+                except OSError as e:
+                    failed += 1
+                    self.stderr.write(f"{stone.certificate}: frame not readable: {e}")
+                    continue
+
+                blobs = [f'{digest}.{path.rsplit(".", 1)[1]}' for path, (digest, _) in zip(paths, hashes)]
+                acquire_blobs({blob: size for blob, (_, size) in zip(blobs, hashes)})
+                for path, blob in zip(paths, blobs):
+                    place_blob(path, blob)
+                frames = {'count': len(blobs), 'width': stone.frames.get('width'), 'height': stone.frames.get('height'), 'blobs': blobs}
+                Stone.objects.filter(pk=stone.pk).update(frames=frames, image_count=len(blobs))
+                migrated += 1
+
+            self.stdout.write(f"Migrated {migrated} stones")
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {migrated} stones migrated, {failed} failed"))
+
+    def recount(self, batch_size):
+        # One reference per stone and distinct blob, as acquire_blobs counts them
+        references = Counter()
+        last_pk = 0
+        while True:
+            stones = list(Stone.objects.filter(pk__gt=last_pk, frames__has_key='blobs').order_by('pk').values_list('pk', 'frames')[:batch_size])
+            if not stones:
+                break
+            last_pk = stones[-1][0]
+            for _, frames in stones:
+                references.update({blob.split('.', 1)[0] for blob in frames['blobs']})
+
+        repaired = 0
+        for pk, digest, refcount in FrameBlob.objects.values_list('pk', 'digest', 'refcount').iterator():
+            if references[digest] != refcount:
+                FrameBlob.objects.filter(pk=pk).update(refcount=references[digest])
+                repaired += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Recounted {len(references)} referenced blobs, {repaired} repaired"))
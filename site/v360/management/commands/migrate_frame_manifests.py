@@ -0,0 +1,49 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.signals import post_delete
+from v360.frame_writer import frame_size
+from v360.models import Stone, StoneImages, count_deleted_image, make_frame_manifest
+
+
+class Command(BaseCommand):
+    help = 'Moves the frame lists of stones from StoneImages rows to the per-stone frame manifest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--keep-rows', action='store_true', help='Keep the StoneImages rows after migrating')
+
+    def handle(self, *args, **options):
+        # Without the per-row signal the rows of a stone go in one DELETE, image_count is set from the manifest
+        post_delete.disconnect(count_deleted_image, sender=StoneImages)
+        migrated = 0
+        last_pk = 0
+
+        while True:
+            stones = list(Stone.objects.filter(pk__gt=last_pk, frames__isnull=True).order_by('pk').values_list('pk', flat=True)[:options['batch_size']])
+            if not stones:
+                break
+            last_pk = stones[-1]
+
+            names = {pk: [] for pk in stones}
+            for stone_id, image in StoneImages.objects.filter(stone_id__in=stones).order_by('stone_id', 'id').values_list('stone_id', 'image'):
+                names[stone_id].append(image)
+
+            for pk, stone_names in names.items():
+                width = height = None
+                if stone_names:
+                    try:
+                        width, height = frame_size(os.path.join(settings.MEDIA_ROOT, stone_names[0]))
+                    except OSError as e:
+                        self.stderr.write(f"Stone {pk}: first frame not readable: {e}")
+
+                with transaction.atomic():
+                    if not options['keep_rows']:
+                        StoneImages.objects.filter(stone_id=pk).delete()
+                    Stone.objects.filter(pk=pk).update(frames=make_frame_manifest(stone_names, width, height), image_count=len(stone_names))
+                migrated += 1
+
+            self.stdout.write(f"Migrated {migrated} stones")
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {migrated} stones migrated"))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from v360.models import Stone, StoneImages
+
+
+class Command(BaseCommand):
+    help = 'Backfills and repairs Stone.image_count from the frame manifest or the legacy StoneImages rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report stones with a wrong count')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = repaired = 0
+        last_pk = 0
+
+        # Walks the table by primary key, each batch costs one grouped count
+        while True:
+            stones = list(Stone.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'certificate', 'image_count', 'frames')[:batch_size])
+            if not stones:
+                break
+            last_pk = stones[-1][0]
+
+            counts = dict(
+                StoneImages.objects.filter(stone_id__in=[pk for pk, _, _, frames in stones if frames is None])
+                .order_by().values('stone_id').annotate(count=Count('pk')).values_list('stone_id', 'count')
+            )
+            for pk, certificate, image_count, frames in stones:
+                actual = counts.get(pk, 0) if frames is None else frames['count']
+                if actual == image_count:
+                    continue
+                repaired += 1
+                self.stdout.write(f"{certificate}: {image_count} -> {actual}")
+                if not options['dry_run']:
+                    Stone.objects.filter(pk=pk).update(image_count=actual)
+            checked += len(stones)
+
+        action = 'wrong' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} stones, {repaired} {action}"))
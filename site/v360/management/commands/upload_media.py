@@ -0,0 +1,43 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from v360.models import Stone
+from v360.storage import IMMUTABLE, is_remote, local_path, media_exists, transfer_executor, upload_files
+
+
+class Command(BaseCommand):
+    help = 'Uploads frames and videos from MEDIA_ROOT to the configured remote media storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not is_remote():
+            raise CommandError('MEDIA_STORAGE is local, there is nothing to upload')
+
+        uploaded = 0
+        for folder, cache_control in (('blobs', IMMUTABLE), ('videos', IMMUTABLE)):
+            names = []
+            for root, _, filenames in os.walk(local_path(folder)):
+                for filename in filenames:
+                    if not filename.endswith(('.part', '.sha256')):
+                        names.append(os.path.relpath(os.path.join(root, filename), settings.MEDIA_ROOT))
+            uploaded += self.upload(names, options['batch_size'], cache_control)
+
+        # Frames of stones parsed before the blob store
+        names = []
+        for stone in Stone.objects.exclude(frames__has_key='blobs').iterator():
+            names.extend(name for name in stone.frame_names() if os.path.exists(local_path(name)))
+        uploaded += self.upload(names, options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {uploaded} files uploaded"))
+
+    def upload(self, names, batch_size, cache_control=None) -> int:
+        uploaded = 0
+        for start in range(0, len(names), batch_size):
+            batch = names[start:start + batch_size]
+            batch = [name for name, exists in zip(batch, transfer_executor.map(media_exists, batch)) if not exists]
+            upload_files([(local_path(name), name) for name in batch], cache_control=cache_control)
+            uploaded += len(batch)
+            self.stdout.write(f"Uploaded {uploaded} of {len(names)} files")
+        return uploaded
@@ -0,0 +1,61 @@
+import glob
+import os
+import socket
+import time
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, values
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+if MULTIPROC_DIR:
+    # The directory is shared by the site and every worker container, pids repeat
+    # between containers so files are told apart by host as well
+    values.ValueClass = values.MultiProcessValue(lambda: f'{socket.gethostname()}-{os.getpid()}')
+
+STAGE_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram('v360_stage_seconds', 'Time spent in a pipeline stage', ['stage'], buckets=STAGE_BUCKETS)
+STAGE_FAILURES = Counter('v360_stage_failures_total', 'Pipeline stages that raised', ['stage'])
+PARSES = Counter('v360_parses_total', 'Finished parses', ['pattern_type', 'host', 'outcome'])
+BYTES_DOWNLOADED = Counter('v360_bytes_downloaded_total', 'Frame bytes downloaded from vendors', ['host'])
+FRAMES_PER_STONE = Histogram('v360_frames_per_stone', 'Frames saved per parsed stone', buckets=(8, 16, 32, 64, 128, 192, 256, 384, 512, 1024))
+BROWSER_RSS = Gauge('v360_browser_rss_bytes', 'Memory of the worker Chromium process tree', multiprocess_mode='livesum')
+CHUNK_CACHE = Counter('v360_chunk_cache_total', 'Chunk requests by cache result', ['result'])
+QUEUE_WAIT = Histogram('v360_queue_wait_seconds', 'Time a task spent in the queue before a worker took it', ['task', 'queue'], buckets=STAGE_BUCKETS)
+
+
+def observe_stage(stage: str, seconds: float, failed: bool = False):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if failed:
+        STAGE_FAILURES.labels(stage).inc()
+
+
+@contextmanager
+def stage_timer(stage: str):
+    started = time.monotonic()
+    try:
+        yield
+    except BaseException:
+        observe_stage(stage, time.monotonic() - started, failed=True)
+        raise
+    observe_stage(stage, time.monotonic() - started)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    if not MULTIPROC_DIR:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(f'{socket.gethostname()}-{pid}', MULTIPROC_DIR)
+
+
+def clear_host_files():
+    # Files of the previous run of this container, called once before the processes start
+    if MULTIPROC_DIR:
+        for path in glob.glob(os.path.join(MULTIPROC_DIR, f'*_{socket.gethostname()}-*.db')):
+            os.remove(path)
@@ -0,0 +1,30 @@
+# Generated by Django 5.1 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('v360', '0002_alter_stone_options_remove_stone_is_parsing_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoneParseState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('certificate', models.CharField(max_length=255, unique=True, verbose_name='Certificate')),
+                ('state', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], db_index=True, max_length=16, verbose_name='State')),
+                ('image_count', models.PositiveIntegerField(default=0, verbose_name='Image Count')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Error')),
+                ('queued_at', models.DateTimeField(blank=True, null=True, verbose_name='Queued At')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Started At')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'ordering': ('-updated_at',),
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_image_count(apps, schema_editor):
+    Stone = apps.get_model('v360', 'Stone')
+    StoneImages = apps.get_model('v360', 'StoneImages')
+    counts = StoneImages.objects.filter(stone=OuterRef('pk')).order_by().values('stone').annotate(count=Count('pk')).values('count')
+    Stone.objects.update(image_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('v360', '0003_stoneparsestate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stone',
+            name='image_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, verbose_name='Image Count'),
+        ),
+        migrations.RunPython(backfill_image_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('v360', '0004_stone_image_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stone',
+            name='frames',
+            field=models.JSONField(blank=True, null=True, verbose_name='Frames'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('v360', '0005_stone_frames'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParseEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('certificate', models.CharField(max_length=255, verbose_name='Certificate')),
+                ('stage', models.CharField(max_length=32, verbose_name='Stage')),
+                ('outcome', models.CharField(choices=[('started', 'Started'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('retrying', 'Retrying')], max_length=16, verbose_name='Outcome')),
+                ('duration', models.FloatField(blank=True, null=True, verbose_name='Duration')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Error')),
+                ('created_at', models.DateTimeField(db_index=True, verbose_name='Created At')),
+            ],
+            options={
+                'ordering': ('-created_at',),
+                'indexes': [
+                    models.Index(fields=['certificate', 'created_at'], name='v360_parsee_certifi_183a93_idx'),
+                    models.Index(fields=['stage', 'outcome', 'created_at'], name='v360_parsee_stage_3d07b1_idx'),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('v360', '0006_parseevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FrameBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('extension', models.CharField(max_length=8, verbose_name='Extension')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Size')),
+                ('refcount', models.PositiveIntegerField(db_index=True, default=0, verbose_name='References')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+            ],
+        ),
+    ]
@@ -1,9 +1,11 @@
 from django.db import models
-from django.db.models.signals import post_delete
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.conf import settings
-import shutil
+from .storage import fetch_files
 import os
+import re
 
 def get_stone_image_upload_path(instance, filename):
     return os.path.join('stones', instance.stone.certificate, filename)
@@ -13,11 +15,56 @@ def get_stone_folder_path(certificate: str):
     return os.path.join('stones', certificate)
 
 
+def make_frame_manifest(names: list[str], width: int | None = None, height: int | None = None) -> dict:
+    """
+    Compact frame list of a stone: frames are <folder>/image_1..image_N.<format>,
+    names that don't follow the scheme are listed as they are.
+    """
+    manifest = {'count': len(names), 'width': width, 'height': height}
+    folder = os.path.dirname(names[0]) if names else ''
+    extensions = []
+    for index, name in enumerate(names, 1):
+        stem, _, extension = os.path.basename(name).rpartition('.')
+        if os.path.dirname(name) != folder or stem != f'image_{index}':
+            return {**manifest, 'names': names}
+        extensions.append(extension)
+
+    manifest['folder'] = folder
+    if len(set(extensions)) > 1:
+        manifest['formats'] = extensions
+    else:
+        manifest['format'] = extensions[0] if extensions else None
+    return manifest
+
+
+BLOB_NAME = re.compile(r'(^|/)blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.\w+$')
+
+
+def is_blob_name(name: str) -> bool:
+    return bool(BLOB_NAME.search(name))
+
+
+def get_blob_name(blob: str) -> str:
+    # blob is <sha256>.<extension>, sharded by the first two byte pairs of the hash
+    return f'blobs/{blob[:2]}/{blob[2:4]}/{blob}'
+
+
+def get_frame_names(manifest: dict) -> list[str]:
+    if 'blobs' in manifest:
+        return [get_blob_name(blob) for blob in manifest['blobs']]
+    if 'names' in manifest:
+        return manifest['names']
+    extensions = manifest.get('formats') or [manifest['format']] * manifest['count']
+    return [f"{manifest['folder']}/image_{index}.{extension}" for index, extension in enumerate(extensions, 1)]
+
+
 class Stone(models.Model):
     certificate = models.CharField(max_length=255, verbose_name="Certificate", unique=True, db_index=True)
     base_url = models.URLField(unique=True, verbose_name="Base URL")
     base_folder = models.CharField(max_length=255, verbose_name="Base Folder", blank=True, null=True)
     vendor = models.CharField(max_length=255, verbose_name="Vendor", blank=True, null=True, db_index=True)
+    image_count = models.PositiveIntegerField(default=0, verbose_name="Image Count", db_index=True)
+    frames = models.JSONField(verbose_name="Frames", blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
     
@@ -27,11 +74,30 @@ class Stone(models.Model):
     def __str__(self):
         return self.certificate
     
-    def delete(self, using, keep_parents) -> tuple[int, dict[str, int]]:
-        folder_path = get_stone_folder_path(self.certificate)
-        if os.path.isdir(folder_path):
-            shutil.rmtree(folder_path)
-        return super().delete(using, keep_parents)
+    def frame_names(self) -> list[str]:
+        if self.frames is None:
+            # Stones parsed before frame manifests keep their StoneImages rows until migrate_frame_manifests
+            return list(self.images.order_by('id').values_list('image', flat=True))
+        return get_frame_names(self.frames)
+
+    def frame_paths(self) -> list[str]:
+        # Local paths, frames of a remote storage are downloaded on first use
+        return fetch_files(self.frame_names())
+
+
+class FrameBlob(models.Model):
+    digest = models.CharField(max_length=64, verbose_name="SHA-256", unique=True)
+    extension = models.CharField(max_length=8, verbose_name="Extension")
+    size = models.PositiveBigIntegerField(verbose_name="Size")
+    refcount = models.PositiveIntegerField(default=0, verbose_name="References", db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+
+    @property
+    def blob(self) -> str:
+        return f'{self.digest}.{self.extension}'
+
+    def __str__(self):
+        return f"{self.blob} ({self.refcount})"
 
 
 class StoneImages(models.Model):
@@ -43,6 +109,22 @@ class StoneImages(models.Model):
         return f"Photo for {self.stone.base_url}"
 
 
+def add_image_count(stone_id: int, delta: int):
+    # Stone.image_count mirrors the legacy StoneImages rows of stones without a frame manifest
+    Stone.objects.filter(pk=stone_id).update(image_count=Greatest(F('image_count') + delta, 0))
+
+
+@receiver(post_save, sender=StoneImages)
+def count_created_image(sender, instance, created, **kwargs):
+    if created:
+        add_image_count(instance.stone_id, 1)
+
+
+@receiver(post_delete, sender=StoneImages)
+def count_deleted_image(sender, instance, **kwargs):
+    add_image_count(instance.stone_id, -1)
+
+
 class LinkPatterns(models.Model):
     
     PATTERNS_TYPES = (
@@ -59,6 +141,68 @@ class LinkPatterns(models.Model):
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
     
     
+class StoneParseState(models.Model):
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    STATES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    certificate = models.CharField(max_length=255, verbose_name="Certificate", unique=True)
+    state = models.CharField(max_length=16, verbose_name="State", choices=STATES, db_index=True)
+    image_count = models.PositiveIntegerField(verbose_name="Image Count", default=0)
+    error = models.TextField(verbose_name="Error", blank=True, default='')
+    queued_at = models.DateTimeField(verbose_name="Queued At", blank=True, null=True)
+    started_at = models.DateTimeField(verbose_name="Started At", blank=True, null=True)
+    finished_at = models.DateTimeField(verbose_name="Finished At", blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
+
+    class Meta:
+        ordering = ('-updated_at',)
+
+    def __str__(self):
+        return f"{self.certificate}: {self.state}"
+
+
+class ParseEvent(models.Model):
+
+    STARTED = 'started'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    RETRYING = 'retrying'
+
+    OUTCOMES = (
+        (STARTED, 'Started'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        (RETRYING, 'Retrying'),
+    )
+
+    certificate = models.CharField(max_length=255, verbose_name="Certificate")
+    stage = models.CharField(max_length=32, verbose_name="Stage")
+    outcome = models.CharField(max_length=16, verbose_name="Outcome", choices=OUTCOMES)
+    duration = models.FloatField(verbose_name="Duration", blank=True, null=True)
+    error = models.TextField(verbose_name="Error", blank=True, default='')
+    created_at = models.DateTimeField(verbose_name="Created At", db_index=True)
+
+    class Meta:
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['certificate', 'created_at']),
+            models.Index(fields=['stage', 'outcome', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.certificate}: {self.stage} {self.outcome}"
+
+
 class StoneLog(models.Model):
     stone = models.CharField(max_length=255, verbose_name="Certificate", db_index=True)
     log = models.TextField(verbose_name="Log")
@@ -66,15 +210,6 @@ class StoneLog(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
     
-    def clean_old_logs(self):
-        if StoneLog.objects.count() > 5000:
-            excess_logs = StoneLog.objects.order_by('created_at')[:StoneLog.objects.count() - 5000]
-            excess_logs.delete()
-
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.clean_old_logs()
-    
     def __str__(self):
         return f"Log for {self.stone}"
     
@@ -0,0 +1,111 @@
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Stone, StoneParseState
+
+logger = logging.getLogger(__name__)
+
+STATE_FIELDS = ('state', 'queued_at', 'started_at', 'finished_at', 'image_count', 'error')
+
+
+def state_key(certificate: str) -> str:
+    return f'v360:parse_state:{certificate}'
+
+
+def serialize_state(parse_state: StoneParseState) -> dict:
+    return {
+        'state': parse_state.state,
+        'image_count': parse_state.image_count,
+        'error': parse_state.error,
+        'queued_at': parse_state.queued_at.isoformat() if parse_state.queued_at else None,
+        'started_at': parse_state.started_at.isoformat() if parse_state.started_at else None,
+        'finished_at': parse_state.finished_at.isoformat() if parse_state.finished_at else None,
+    }
+
+
+def cache_states(states: dict):
+    # Redis is the fast path only, the database row stays the source of truth
+    try:
+        cache.set_many({state_key(certificate): state for certificate, state in states.items()}, settings.PARSE_STATE_TTL)
+    except Exception as e:
+        logger.warning(f"Error while caching parse states: {e}")
+
+
+def set_queued(certificates: list[str]):
+    now = timezone.now()
+    parse_states = [
+        StoneParseState(certificate=certificate, state=StoneParseState.QUEUED, queued_at=now, started_at=None, finished_at=None, image_count=0, error='')
+        for certificate in dict.fromkeys(certificates)
+    ]
+    # MySQL upserts through ON DUPLICATE KEY UPDATE on the certificate index and takes no conflict target
+    unique_fields = ['certificate'] if connection.features.supports_update_conflicts_with_target else None
+    StoneParseState.objects.bulk_create(
+        parse_states,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=[*STATE_FIELDS, 'updated_at'],
+    )
+    cache_states({parse_state.certificate: serialize_state(parse_state) for parse_state in parse_states})
+
+
+def set_state(certificate: str, state: str, image_count: int | None = None, error: str = ''):
+    now = timezone.now()
+    fields = {'state': state, 'error': error}
+    if state == StoneParseState.QUEUED:
+        fields.update(queued_at=now, started_at=None, finished_at=None, image_count=0)
+    elif state == StoneParseState.RUNNING:
+        fields.update(started_at=now, finished_at=None)
+    else:
+        fields.update(finished_at=now)
+    if image_count is not None:
+        fields['image_count'] = image_count
+
+    parse_state = StoneParseState.objects.update_or_create(certificate=certificate, defaults=fields)[0]
+    cache_states({certificate: serialize_state(parse_state)})
+
+
+def get_states(certificates: list[str]) -> dict:
+    keys = {state_key(certificate): certificate for certificate in certificates}
+    try:
+        states = {keys[key]: state for key, state in cache.get_many(keys).items()}
+    except Exception as e:
+        logger.warning(f"Error while reading parse states: {e}")
+        states = {}
+
+    missing = [certificate for certificate in keys.values() if certificate not in states]
+    if missing:
+        found = {
+            parse_state.certificate: serialize_state(parse_state)
+            for parse_state in StoneParseState.objects.filter(certificate__in=missing)
+        }
+        # Stones parsed before parse states were recorded, only a complete frame set counts as parsed
+        legacy = Stone.objects.filter(certificate__in=[certificate for certificate in missing if certificate not in found])
+        for certificate, image_count in legacy.values_list('certificate', 'image_count'):
+            complete = image_count >= settings.PARSER_COMPLETE_FRAMES
+            found[certificate] = {
+                'state': StoneParseState.SUCCEEDED if complete else StoneParseState.FAILED,
+                'image_count': image_count,
+                'error': '' if complete else f'Incomplete frame set ({image_count} of {settings.PARSER_COMPLETE_FRAMES})',
+                'queued_at': None, 'started_at': None, 'finished_at': None,
+            }
+        if found:
+            cache_states(found)
+        states.update(found)
+
+    return states
+
+
+@receiver(post_delete, sender=Stone)
+def forget_deleted_stone(sender, instance, **kwargs):
+    # A deleted stone is no longer parsed, queued, running and failed states still hold
+    StoneParseState.objects.filter(certificate=instance.certificate, state=StoneParseState.SUCCEEDED).delete()
+    try:
+        cached = cache.get(state_key(instance.certificate))
+        if cached and cached['state'] == StoneParseState.SUCCEEDED:
+            cache.delete(state_key(instance.certificate))
+    except Exception as e:
+        logger.warning(f"Error while clearing the parse state of {instance.certificate}: {e}")
@@ -1,95 +1,42 @@
 import logging
-import os
-import base64
 import re
-import io
-import gc
+import json
 import asyncio
-import psutil
-import signal
+from urllib.parse import urlsplit
 from asgiref.sync import sync_to_async
-from PIL import Image
-from pyppeteer import launch
-from .models import Stone, StoneImages, LinkPatterns, StoneLog, get_stone_folder_path
+from .browser_pool import browser_pool
+from .bundles import build_chunk_bundles
+from .completion import FrameCollector, wait_for_v360_frames
+from .fetcher import FrameTemplate, frame_fetcher
+from .frame_writer import FrameWriter
+from .host_limiter import host_limiter
+from .metrics import FRAMES_PER_STONE, PARSES, stage_timer
+from .events import timed_event
+from .models import Stone, get_stone_folder_path
+from .patterns import get_pattern_index
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
-def close_existing_browsers():
-    browser_process_names = ['chromium', 'chrome']  # Или другие имена процессов, если они отличаются
-    for proc in psutil.process_iter(['pid', 'name']):
-        if proc.info['name'] in browser_process_names:
-            try:
-                logger.info(f"Terminating browser process: {proc.info['name']} (PID: {proc.info['pid']})")
-                proc.send_signal(signal.SIGTERM)  # Отправляем сигнал завершения процесса
-            except psutil.NoSuchProcess:
-                logger.warning(f"Process {proc.info['pid']} already terminated.")
-            except Exception as e:
-                logger.error(f"Error while terminating process {proc.info['pid']}: {e}")
-
-
-async def decode_and_save_images(data: list[str], stone):
-    save_dir = get_stone_folder_path(stone.certificate)
-    media_dir = os.path.join(settings.MEDIA_ROOT, save_dir)
-
-    if not os.path.exists(media_dir):
-        os.makedirs(media_dir)
-
-    images = []
-    for i, img_data in enumerate(data):
-        try:
-            img_bytes = base64.b64decode(img_data.split(',')[1])
-            image = Image.open(io.BytesIO(img_bytes))
-            format = image.format if image.format else "JPEG"
-            image.save(os.path.join(media_dir, f'image_{i+1}.{format.lower()}'), format)
-            
-            images.append(StoneImages(stone=stone, image=save_dir + f'/image_{i+1}.{format.lower()}'))
-
-        finally:
-            image.close()
-            gc.collect()
-    
-    await sync_to_async(StoneImages.objects.bulk_create)(images)
-
-async def browser_launch(retries=3):
-    close_existing_browsers()
-    try:
-        for attempt in range(retries):
-            try:
-                browser = await launch({
-                    'handleSIGINT': False,
-                    'handleSIGTERM': False,
-                    'handleSIGHUP': False,
-                    'headless': True,
-                    'executablePath': '/usr/bin/chromium',
-                    'args': [
-                        '--no-sandbox',
-                        '--disable-setuid-sandbox',
-                        '--disable-dev-shm-usage',
-                        '--disable-gpu',
-                        '--disable-popup-blocking',
-                        '--no-zygote'
-                    ],
-                    'defaultViewport': None,
-                })
-                logger.warning(f"Browser launched: {browser.wsEndpoint}")
-                return browser
-            except Exception as e:
-                logger.error(f"Error while launching browser (attempt {attempt+1}/{retries}): {e}")
-                if attempt + 1 == retries:
-                    raise
-                await asyncio.sleep(5)
-    except Exception as final_error:
-        logger.error(f"Failed to launch browser after {retries} attempts: {final_error}")
-        return None
+# Upper bounds, parsing returns as soon as the frame set is complete
+V360_FRAMES_TIMEOUT = 20
+GEM360_FRAMES_TIMEOUT = 10
+JAYKAR_FRAMES_TIMEOUT = 1000
+JAYKAR_EXPECTED_FRAMES = 256
+JAYKAR_FRAME_NAME = re.compile(r'^(\d+).*\.(jpeg|webp|jpg)$')
+GEM360_CHUNK_NAME = re.compile(r'^\d+(\.json)?$')
 
 
 class Parser360:
-    def __init__(self, url: str, cert: str, vendor: str):
+    def __init__(self, url: str, cert: str, vendor: str, recreate: bool | None = None):
         self._url = url
         self._cert = cert
         self._vendor = vendor
+        self._recreate = settings.DEBUG if recreate is None else recreate
         self.stone = None
+        self.image_count = 0
+        self._writer = None
+        self._pattern_type = None
 
         self._parse_functions = {
             'v360': self._parse_from_var,
@@ -97,176 +44,205 @@ class Parser360:
             'jaykar': self._parse_from_image,
         }
 
+        # Vendors with numbered frame URLs are downloaded without the browser
+        self._fetch_functions = {
+            'gem360': self._fetch_chunks,
+            'jaykar': self._fetch_images,
+        }
+
+        # Vendors with a fixed frame count, frames past it are not part of the set
+        self._frame_limits = {
+            'jaykar': JAYKAR_EXPECTED_FRAMES,
+        }
+
     # Public function
     
     async def use_parser(self):
-        self.stone = await sync_to_async(self._define_stone)(recreate=settings.DEBUG)
-        images_exist = await sync_to_async(StoneImages.objects.filter(stone=self.stone).exists)()
+        self.stone = await sync_to_async(self._define_stone)(recreate=self._recreate)
+        self.image_count = self.stone.image_count
 
-        if not images_exist:
-            await self._parse_images()
-            
+        # A stone kept with part of its frames is parsed again, the new set replaces it
+        if self.image_count < settings.PARSER_COMPLETE_FRAMES:
+            host = urlsplit(self._url).hostname or ''
             try:
-                log = await sync_to_async(StoneLog.objects.get)(stone=self.stone.certificate)
-                log.log = log.log + f"Success\n----------------\n"
-                await sync_to_async(log.save)()
-            except:
-                pass
-                
+                await self._parse_images()
+            except BaseException:
+                PARSES.labels(self._pattern_type or 'unknown', host, 'failed').inc()
+                raise
+            PARSES.labels(self._pattern_type, host, 'succeeded').inc()
+            FRAMES_PER_STONE.observe(self.image_count)
             
         return self.stone
 
     # Parse functions
 
     async def _parse_images(self):
-        browser = await browser_launch()
-        if not browser:
-            logger.error("Browser closed")
-            return None
-
-        pattern_type = await sync_to_async(self._define_pattern)(self._url)
+        pattern_type = self._pattern_type = await sync_to_async(self._define_pattern)(self._url)
 
         if not pattern_type:
             await self._delete_stone()
             raise Exception("Pattern not found")
 
-        parse_function = self._parse_functions.get(pattern_type)
+        # Frames are written while they arrive, a browser fallback or a retry reuses those already written
+        self._writer = FrameWriter(self.stone)
+        resumed = len(self._writer)
+        if resumed:
+            logger.warning(f"Resuming {self._cert} with {resumed} frames from a previous attempt")
 
-        images = await parse_function(browser)
+        fetched = False
+        fetch_function = self._fetch_functions.get(pattern_type)
+        if fetch_function:
+            try:
+                with timed_event(self._cert, f'fetch:{pattern_type}'):
+                    await fetch_function()
+                # Frames kept from a previous attempt don't count, a fetch that found nothing falls back
+                fetched = len(self._writer) > resumed
+            except Exception as e:
+                logger.warning(f"Direct fetch failed for {self._cert}, falling back to browser: {e}")
+
+        if not fetched:
+            parse_function = self._parse_functions.get(pattern_type)
+
+            with timed_event(self._cert, f'browser:{pattern_type}'):
+                async with browser_pool.lease() as page:
+                    await parse_function(page)
 
-        if not images:
+        with timed_event(self._cert, 'write'):
+            self.image_count = await self._writer.finish(limit=self._frame_limits.get(pattern_type))
+        if not self.image_count:
             await self._delete_stone()
             raise Exception("Images not found")
 
-        await decode_and_save_images(images, self.stone)
-
-        if browser:
-            await browser.close()
-            logger.info("Browser closed")
+        try:
+            with timed_event(self._cert, 'bundles'):
+                await sync_to_async(build_chunk_bundles)(self.stone)
+        except Exception as e:
+            # The viewer falls back to base64 chunks without bundles
+            logger.error(f"Error while building chunk bundles for {self._cert}: {e}")
 
-    async def _parse_from_var(self, browser) -> list[str]:
-        page = await browser.newPage()
-        await page.goto(self._url, timeout=600000)
+    async def _parse_from_var(self, page):
+        async with host_limiter.limit(self._url, kind='page'):
+            with stage_timer('page_goto'):
+                await page.goto(self._url, timeout=600000)
 
-        try:
-            await page.waitForSelector('canvas', {'timeout': 300000})
-        except:
+        with stage_timer('wait_selector'):
             try:
-                await page.waitForSelector('.v360-canvas', {'timeout': 300000})
+                await page.waitForSelector('canvas', {'timeout': 300000})
             except:
-                await self._delete_stone()
-                raise Exception("Canvas not found")
-                
-
-        await asyncio.sleep(20)
+                try:
+                    await page.waitForSelector('.v360-canvas', {'timeout': 300000})
+                except:
+                    # Frames written so far are kept for the retry
+                    raise Exception("Canvas not found")
 
-        frames_data = await page.evaluate('frames')
+        with stage_timer('wait_frames'):
+            loaded = await wait_for_v360_frames(page, timeout=V360_FRAMES_TIMEOUT, quiet=settings.PARSER_FRAMES_QUIET_SECONDS)
+        logger.info(f"{loaded} v360 frames loaded for {self._cert}")
 
-        await page.close()
+        with stage_timer('evaluate_frames'):
+            frames_data = await page.evaluate('frames')
 
-        return frames_data[0]
+        for index, frame in enumerate(frames_data[0]):
+            if frame:
+                await self._writer.submit(index, frame)
 
-    async def _parse_from_chunks(self, browser):
-        self.gem360_collection = []
-
-        page = await browser.newPage()
+    async def _parse_from_chunks(self, page):
+        self.gem360_collection = FrameCollector()
 
         page.on('response', lambda response: asyncio.ensure_future(self._log_response_gem360(response)))
 
-        await page.goto(self._url)
+        async with host_limiter.limit(self._url, kind='page'):
+            with stage_timer('page_goto'):
+                await page.goto(self._url)
 
-        try:
-            await page.waitForSelector('canvas', {'timeout': 300000})
-        except:
+        with stage_timer('wait_selector'):
             try:
-                await page.waitForSelector('.v360-canvas', {'timeout': 300000})
+                await page.waitForSelector('canvas', {'timeout': 300000})
             except:
-                await self._delete_stone()
-                raise Exception("Canvas not found")
+                try:
+                    await page.waitForSelector('.v360-canvas', {'timeout': 300000})
+                except:
+                    # Frames written so far are kept for the retry
+                    raise Exception("Canvas not found")
 
-        await asyncio.sleep(10)
+        with stage_timer('wait_frames'):
+            await self.gem360_collection.wait(timeout=GEM360_FRAMES_TIMEOUT, quiet=settings.PARSER_FRAMES_QUIET_SECONDS)
 
-        structured_data = {}
-        for json in self.gem360_collection:
-            for item in json:
-                if isinstance(item, dict):
-                    try:
-                        structured_data[item['data_index']] = item['image']
-                    except Exception as e:
-                        raise Exception(f"Error while structuring data: {e}")
-
-        sorted_keys = sorted(structured_data.keys())
-        sorted_values = [structured_data[key] for key in sorted_keys]
-
-        await page.close()
+    async def _parse_from_image(self, page):
+        self.jaykar_collection = FrameCollector(expected=JAYKAR_EXPECTED_FRAMES)
 
-        return sorted_values
-
-    async def _parse_from_image(self, browser):
-        self.jaykar_collection = {}
-        page = await browser.newPage()
-        
         page.on('response', lambda response: asyncio.ensure_future(self._log_response_jaykar(response)))
         
-        await page.goto(self._url, waitUntil='networkidle0', timeout=60000)
+        async with host_limiter.limit(self._url, kind='page'):
+            with stage_timer('page_goto'):
+                await page.goto(self._url, waitUntil='networkidle0', timeout=60000)
+
+        with stage_timer('wait_frames'):
+            await self.jaykar_collection.wait(timeout=JAYKAR_FRAMES_TIMEOUT)
 
-        total_timeout = 1000
-        interval = 1
-        elapsed_time = 0
-        
-        while elapsed_time < total_timeout:
-            if len(self.jaykar_collection) >= 256:
-                break
-            await asyncio.sleep(interval)
-            elapsed_time += interval
 
-        self.jaykar_collection = dict(sorted(self.jaykar_collection.items()))
-        images = list(self.jaykar_collection.values())
+    # Fetch functions
 
-        await page.close()
+    async def _fetch_chunks(self):
+        chunk_url = await frame_fetcher.discover(self._url, self._is_gem360_chunk)
+        template = FrameTemplate(chunk_url)
 
-        return images
+        async def on_chunk(index, content):
+            for item in json.loads(content):
+                if isinstance(item, dict):
+                    await self._writer.submit(item['data_index'], item['image'])
 
+        await frame_fetcher.fetch_until_missing(template, start=0, on_frame=on_chunk)
+
+    async def _fetch_images(self):
+        frame_url = await frame_fetcher.discover(self._url, self._is_jaykar_frame)
+        template = FrameTemplate(frame_url)
+        # Numbering starts at 0 or 1 depending on the vendor, frames kept from a previous attempt are skipped
+        indexes = [index for index in range(0, JAYKAR_EXPECTED_FRAMES + 1) if index not in self._writer]
+        await frame_fetcher.fetch_range(template, indexes, on_frame=self._writer.submit)
 
     # Callback functions
 
     async def _log_response_gem360(self, response):
         try:
-            content_type = response.headers.get('content-type', '')
-            if 'application/json' in content_type:
-                self.gem360_collection.append(await response.json())
+            if self._is_gem360_chunk(response):
+                for item in await response.json():
+                    if isinstance(item, dict) and self.gem360_collection.add(item['data_index']):
+                        await self._writer.submit(item['data_index'], item['image'])
         except Exception as e:
             raise Exception(f"Error while logging response gem360: {e}")
 
     async def _log_response_jaykar(self, response):
         try:
-            content_type = response.headers.get('content-type', '')
-            if 'image/jpeg' in content_type or 'image/webp' in content_type or 'image/jpg' in content_type:
-                url = response.url
-                filename = url.split('/')[-1]
-                match = re.match(r'^(\d+).*\.(jpeg|webp|jpg)$', filename)
-                if match:
-                    image_index = int(match.group(1))
-                    if image_index not in self.jaykar_collection:
-                        self.jaykar_collection[image_index] = await response.buffer()
-                    else:
-                        return
+            if self._is_jaykar_frame(response):
+                filename = response.url.split('/')[-1]
+                image_index = int(JAYKAR_FRAME_NAME.match(filename).group(1))
+                if self.jaykar_collection.add(image_index):
+                    await self._writer.submit(image_index, await response.buffer())
         except Exception as e:
             raise Exception(f"Error while logging response jaykar: {e}")
 
     # Helper functions
 
+    @staticmethod
+    def _is_gem360_chunk(response) -> bool:
+        # Numbered chunks only, other JSON requests of the page are not frame data
+        if 'application/json' not in response.headers.get('content-type', ''):
+            return False
+        return bool(GEM360_CHUNK_NAME.match(urlsplit(response.url).path.rstrip('/').split('/')[-1]))
+
+    @staticmethod
+    def _is_jaykar_frame(response) -> bool:
+        content_type = response.headers.get('content-type', '')
+        if 'image/jpeg' in content_type or 'image/webp' in content_type or 'image/jpg' in content_type:
+            return bool(JAYKAR_FRAME_NAME.match(response.url.split('/')[-1]))
+        return False
 
     async def _delete_stone(self):
         await sync_to_async(self.stone.delete)(using='default', keep_parents=False)
 
     def _define_pattern(self, url):
-        patterns = LinkPatterns.objects.all()
-        for pattern_obj in patterns:
-            pattern = pattern_obj.pattern
-            if pattern in url:
-                return pattern_obj.pattern_type
-        return None
+        return get_pattern_index().match(url)
 
     def _define_stone(self, recreate: bool = False):
         stone = Stone.objects.filter(certificate=self._cert)
@@ -0,0 +1,66 @@
+import re
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import LinkPatterns
+
+PATTERNS_VERSION_KEY = 'v360:link_patterns:version'
+
+
+class PatternIndex:
+    """
+    LinkPatterns compiled once for matching many URLs.
+
+    All patterns go through a single compiled alternation. Every hit is
+    collected and the earliest row wins, like the linear scan this replaces.
+    """
+
+    def __init__(self, rows):
+        self.patterns = {}
+        for priority, (pattern, pattern_type) in enumerate(rows):
+            self.patterns.setdefault(pattern, (priority, pattern_type))
+
+        # A lookahead consumes nothing, overlapping matches are found at every position. The
+        # alternatives are in row order, so each position yields its earliest matching row
+        self.regex = re.compile('(?=(' + '|'.join(re.escape(pattern) for pattern in self.patterns) + '))') if self.patterns else None
+
+    def match(self, url: str) -> str | None:
+        if not self.regex:
+            return None
+        hits = [self.patterns[match.group(1)] for match in self.regex.finditer(url)]
+        return min(hits)[1] if hits else None
+
+
+_index = None
+_version = None
+_checked_at = 0.0
+
+
+def get_pattern_index() -> PatternIndex:
+    global _index, _version, _checked_at
+
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < settings.PATTERN_INDEX_CHECK_SECONDS:
+        return _index
+
+    version = cache.get(PATTERNS_VERSION_KEY, 0)
+    if _index is None or version != _version:
+        rows = LinkPatterns.objects.order_by('pk').values_list('pattern', 'pattern_type')
+        _index = PatternIndex(rows)
+        _version = version
+    _checked_at = now
+    return _index
+
+
+@receiver(post_save, sender=LinkPatterns)
+@receiver(post_delete, sender=LinkPatterns)
+def invalidate_pattern_index(**kwargs):
+    global _index
+    _index = None
+    # Other processes rebuild once they notice the new version
+    try:
+        cache.incr(PATTERNS_VERSION_KEY)
+    except ValueError:
+        cache.set(PATTERNS_VERSION_KEY, 1, None)
@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import shutil
+from PIL import Image
+from django.conf import settings
+from django.core.cache import cache
+from .bundles import frames_version
+from .models import get_stone_folder_path
+from .video import encode_frames
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_CONTENT_TYPES = {
+    'webp': 'image/webp',
+    'gif': 'image/gif',
+    'mp4': 'video/mp4',
+}
+
+
+def get_previews_folder_path(certificate: str):
+    return os.path.join(get_stone_folder_path(certificate), 'previews')
+
+
+def get_previews_manifest_path(certificate: str):
+    return os.path.join(settings.MEDIA_ROOT, get_previews_folder_path(certificate), 'previews.json')
+
+
+def render_animation(image_paths: list[str], output_path: str, image_format: str, width: int, fps: int):
+    frames = []
+    for path in image_paths:
+        with Image.open(path) as image:
+            height = max(round(image.height * width / image.width), 1)
+            frame = image.convert('RGB').resize((width, height), Image.Resampling.LANCZOS)
+        if image_format == 'GIF':
+            frame = frame.quantize(colors=256)
+        frames.append(frame)
+
+    frames[0].save(
+        output_path,
+        image_format,
+        save_all=True,
+        append_images=frames[1:],
+        duration=round(1000 / fps),
+        loop=0,
+        quality=settings.PREVIEW_QUALITY,
+    )
+
+
+def render_preview(image_paths: list[str], output_path: str, preview_format: str, options: dict):
+    # Every `step`-th frame keeps the full turn in a fraction of the frames
+    paths = image_paths[::options.get('step', 1)]
+    if preview_format == 'mp4':
+        encode_frames(
+            paths,
+            output_path,
+            fps=options['fps'],
+            codec=settings.VIDEO_CODEC,
+            preset=options.get('preset', 'veryfast'),
+            crf=options.get('crf', 30),
+            filters=[f"scale={options['width']}:-2"],
+        )
+    else:
+        render_animation(paths, output_path, preview_format.upper(), options['width'], options['fps'])
+
+
+def build_stone_previews(stone) -> dict:
+    image_paths = stone.frame_paths()
+    if not image_paths:
+        raise ValueError(f"No images found for stone: {stone.certificate}")
+
+    version = frames_version(image_paths)
+    previews_dir = get_previews_folder_path(stone.certificate)
+    version_dir = os.path.join(previews_dir, version)
+    os.makedirs(os.path.join(settings.MEDIA_ROOT, version_dir), exist_ok=True)
+
+    files = {}
+    failed = []
+    for preview_format, options in settings.PREVIEWS.items():
+        path = os.path.join(version_dir, f'preview.{preview_format}')
+        try:
+            render_preview(image_paths, os.path.join(settings.MEDIA_ROOT, path), preview_format, options)
+            files[preview_format] = path
+        except Exception as e:
+            logger.error(f"Error while rendering {preview_format} preview for {stone.certificate}: {e}")
+            failed.append(preview_format)
+
+    # Failed formats are not requested again until the frames change
+    manifest = {'version': version, 'files': files, 'failed': failed}
+
+    manifest_path = get_previews_manifest_path(stone.certificate)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    for entry in os.scandir(os.path.join(settings.MEDIA_ROOT, previews_dir)):
+        if entry.is_dir() and entry.name != version:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    logger.info(f"Built {len(files)} previews for {stone.certificate}, version {version}")
+    return manifest
+
+
+def previews_lock_key(certificate: str) -> str:
+    return f'v360:previews:render:{certificate}'
+
+
+def previews_failed_key(certificate: str) -> str:
+    return f'v360:previews:failed:{certificate}'
+
+
+def mark_previews_failed(certificate: str):
+    cache.set(previews_failed_key(certificate), 1, settings.VIDEO_RENDER_FAILED_SECONDS)
+
+
+def previews_failed(certificate: str, manifest: dict | None, preview_format: str) -> bool:
+    if manifest and preview_format in manifest.get('failed', []):
+        return True
+    return cache.get(previews_failed_key(certificate)) is not None
+
+
+def request_previews(certificate: str) -> bool:
+    from .tasks import build_previews
+    if not cache.add(previews_lock_key(certificate), 1, settings.VIDEO_RENDER_LOCK_SECONDS):
+        return False
+    build_previews.delay(certificate)
+    return True
+
+
+def read_previews_manifest(certificate: str) -> dict | None:
+    try:
+        with open(get_previews_manifest_path(certificate)) as manifest_file:
+            return json.load(manifest_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
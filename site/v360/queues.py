@@ -0,0 +1,25 @@
+import logging
+from django.conf import settings
+from core.celery import app
+
+logger = logging.getLogger(__name__)
+
+
+def queue_names() -> list[str]:
+    return [settings.QUEUE_INTERACTIVE, settings.QUEUE_BULK, settings.QUEUE_VIDEO]
+
+
+def queue_depths() -> dict:
+    depths = {}
+    with app.connection_for_read() as connection:
+        channel = connection.default_channel
+        for name in queue_names():
+            try:
+                # Passive declare only reads the size, summed over all priority steps
+                depths[name] = channel.queue_declare(queue=name, passive=True).message_count
+            except Exception as e:
+                # The broker drops an empty queue, passive declare then fails
+                logger.debug(f"Queue {name} not found: {e}")
+                depths[name] = 0
+                channel = connection.channel()
+    return depths
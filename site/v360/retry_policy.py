@@ -0,0 +1,52 @@
+import asyncio
+import random
+import httpx
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.db import InterfaceError, OperationalError
+from pyppeteer.errors import NetworkError, PageError, TimeoutError as BrowserTimeoutError
+
+# Errors worth another attempt: the vendor or our own infrastructure was unavailable for a while
+TRANSIENT_TYPES = (
+    asyncio.TimeoutError,
+    TimeoutError,
+    ConnectionError,
+    httpx.TransportError,
+    BrowserTimeoutError,
+    NetworkError,
+    PageError,
+    InterfaceError,
+    OperationalError,
+    SoftTimeLimitExceeded,
+)
+
+# The parser wraps errors into plain exceptions, those are recognised by message
+TRANSIENT_MESSAGES = (
+    'Server has gone away',
+    'Lost connection',
+    'Canvas not found',
+    'Navigation Timeout',
+    'net::ERR_',
+    'Connection reset',
+    'timed out',
+    'Browser not launched',
+)
+
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    if isinstance(error, TRANSIENT_TYPES):
+        return True
+    message = str(error)
+    return any(pattern in message for pattern in TRANSIENT_MESSAGES)
+
+
+def is_connection_error(error: BaseException) -> bool:
+    return isinstance(error, (InterfaceError, OperationalError)) or 'Server has gone away' in str(error)
+
+
+def retry_countdown(retries: int) -> float:
+    # Exponential backoff with equal jitter, retries of one feed don't hit the vendor together
+    delay = min(settings.PARSER_RETRY_BASE_DELAY * 2 ** retries, settings.PARSER_RETRY_MAX_DELAY)
+    return delay / 2 + random.uniform(0, delay / 2)
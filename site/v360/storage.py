@@ -0,0 +1,160 @@
+import logging
+import mimetypes
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from .metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Shared by uploads and downloads of the process, each transfer blocks on the network
+transfer_executor = ThreadPoolExecutor(max_workers=settings.STORAGE_TRANSFER_WORKERS, thread_name_prefix='storage')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+_transfer_config = None
+_trim_lock = threading.Lock()
+_trimmed_at = 0.0
+
+
+def is_remote() -> bool:
+    # Media under MEDIA_ROOT is the storage itself for the local backend and a cache of it for the others
+    return not isinstance(default_storage, FileSystemStorage)
+
+
+def local_path(name: str) -> str:
+    return os.path.join(settings.MEDIA_ROOT, name)
+
+
+def media_url(name: str, filename: str | None = None) -> str:
+    # nginx serves local media, remote media is a presigned or CDN url
+    if not is_remote():
+        return settings.MEDIA_URL + name
+    if filename:
+        return default_storage.url(name, parameters={'ResponseContentDisposition': f'attachment; filename="{filename}"'})
+    return default_storage.url(name)
+
+
+def media_exists(name: str) -> bool:
+    if not is_remote():
+        return os.path.exists(local_path(name))
+    return default_storage.exists(name)
+
+
+def upload_file(path: str, name: str, cache_control: str | None = None):
+    """
+    Stores a local file under `name`. Files over STORAGE_MULTIPART_THRESHOLD_MB
+    go in parts, STORAGE_MULTIPART_CONCURRENCY of them at a time.
+    """
+    if not is_remote():
+        target = local_path(name)
+        if os.path.abspath(path) != os.path.abspath(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(path, target)
+        return
+
+    extra_args = {'ContentType': mimetypes.guess_type(name)[0] or 'application/octet-stream'}
+    if cache_control:
+        extra_args['CacheControl'] = cache_control
+    with stage_timer('storage_upload'):
+        default_storage.bucket.upload_file(path, name, ExtraArgs=extra_args, Config=transfer_config())
+
+
+def upload_files(files: list[tuple[str, str]], cache_control: str | None = None):
+    # (path, name) pairs, uploaded in parallel
+    list(transfer_executor.map(lambda file: upload_file(*file, cache_control=cache_control), files))
+
+
+def fetch_files(names: list[str], indexes: list[int] | None = None) -> list[str]:
+    """
+    Local paths of media files. With a remote backend the missing ones are
+    downloaded to MEDIA_ROOT in parallel first, later reads on the host hit the copy.
+    With indexes only those files are downloaded, paths are returned for all of them.
+    """
+    paths = [local_path(name) for name in names]
+    if is_remote():
+        wanted = range(len(names)) if indexes is None else indexes
+        missing = [(names[index], paths[index]) for index in wanted if not os.path.exists(paths[index])]
+        list(transfer_executor.map(lambda file: download_file(*file), missing))
+        if missing:
+            trim_local_cache()
+    return paths
+
+
+def download_file(name: str, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Concurrent downloads of the same file don't see each other's partial copy
+    tmp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.part'
+    with stage_timer('storage_download'):
+        default_storage.bucket.download_file(name, tmp_path, Config=transfer_config())
+    os.replace(tmp_path, path)
+
+
+def delete_media(name: str):
+    if is_remote():
+        default_storage.delete(name)
+    try:
+        os.remove(local_path(name))
+    except FileNotFoundError:
+        pass
+
+
+def delete_media_folder(folder: str):
+    if is_remote():
+        default_storage.bucket.objects.filter(Prefix=folder.rstrip('/') + '/').delete()
+    shutil.rmtree(local_path(folder), ignore_errors=True)
+
+
+def trim_local_cache():
+    """
+    Keeps the local copies of remote blobs under STORAGE_LOCAL_CACHE_MB, least
+    recently used first. Scans at most once per STORAGE_LOCAL_CACHE_INTERVAL in a process.
+    """
+    global _trimmed_at
+    root = local_path('blobs')
+    if not is_remote() or not os.path.isdir(root):
+        return
+    if time.monotonic() - _trimmed_at < settings.STORAGE_LOCAL_CACHE_INTERVAL or not _trim_lock.acquire(blocking=False):
+        return
+    try:
+        _trimmed_at = time.monotonic()
+        files = []
+        for folder, _, names in os.walk(root):
+            for name in names:
+                if name.endswith('.part'):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_atime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        max_bytes = settings.STORAGE_LOCAL_CACHE_MB * 1024 * 1024
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+    finally:
+        _trim_lock.release()
+
+
+def transfer_config():
+    global _transfer_config
+    if _transfer_config is None:
+        from boto3.s3.transfer import TransferConfig
+        _transfer_config = TransferConfig(
+            multipart_threshold=settings.STORAGE_MULTIPART_THRESHOLD_MB * 1024 * 1024,
+            multipart_chunksize=settings.STORAGE_MULTIPART_CHUNK_MB * 1024 * 1024,
+            max_concurrency=settings.STORAGE_MULTIPART_CONCURRENCY,
+        )
+    return _transfer_config
@@ -1,74 +1,304 @@
 from celery.app import shared_task
+from celery.signals import before_task_publish, task_postrun, task_prerun, worker_init, worker_process_shutdown
 from .parser import Parser360
-from .models import StoneLog, Stone
+from .browser_pool import browser_pool
+from .fetcher import frame_fetcher
+from .host_limiter import host_limiter
+from .models import ParseEvent, Stone, StoneParseState
+from .blobs import sweep_blobs
+from .chunk_cache import invalidate_chunks
+from .events import flush_events, prune_events, record_event
+from .metrics import QUEUE_WAIT, clear_host_files, mark_process_dead
+from .parse_state import set_state
+from .frame_writer import clear_checkpoint
+from .retry_policy import is_connection_error, is_transient, retry_countdown
+from .atlas import build_stone_atlas
+from .derivatives import build_stone_derivatives
+from .previews import build_stone_previews, mark_previews_failed, previews_lock_key
+from .video import generate_video
+from .video_cache import mark_render_failed, stone_fingerprint, store_video, render_lock_key, video_exists
+from django.core.cache import cache
 import logging
 import asyncio
+import os
+import time
+from datetime import datetime
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from celery.exceptions import Ignore, SoftTimeLimitExceeded
 from django.db import connection
 
 logger = logging.getLogger(__name__)
 
+
+@worker_init.connect
+def clear_metrics(**kwargs):
+    clear_host_files()
+
+
+@worker_process_shutdown.connect
+def close_browser_pool(**kwargs):
+    flush_events()
+    browser_pool.shutdown()
+    mark_process_dead(os.getpid())
+
+
+@before_task_publish.connect
+def stamp_sent_at(headers=None, **kwargs):
+    headers['sent_at'] = time.time()
+
+
+@task_prerun.connect
+def observe_queue_wait(task=None, **kwargs):
+    sent_at = getattr(task.request, 'sent_at', None)
+    if not sent_at:
+        return
+    # A countdown is not waiting time, the wait starts at the eta
+    if task.request.eta:
+        sent_at = max(sent_at, datetime.fromisoformat(task.request.eta).timestamp())
+    queue = (task.request.delivery_info or {}).get('routing_key') or ''
+    QUEUE_WAIT.labels(task.name, queue).observe(max(time.time() - sent_at, 0))
+
+
+@task_postrun.connect
+def write_parse_events(**kwargs):
+    flush_events()
+
+
 @shared_task(bind=True, time_limit=1200, soft_time_limit=1140)  # 20 минут жесткий лимит, 19 минут мягкий лимит
-def parse_v360_data(self, source, certificate, vendor):
+def parse_v360_data(self, source, certificate, vendor, resume=False):
     if source and certificate:
         try:
             logger.warning(f"Starting parsing for {certificate}")
-            log = StoneLog.objects.get_or_create(stone=certificate)[0]
-            log.log = log.log + f"\nStarting parsing\n----\n"
-            log.save()
+            record_event(certificate, 'parse', ParseEvent.STARTED)
+            set_state(certificate, StoneParseState.RUNNING)
         except Exception as e:
-            logger.error(f"Error while creating log for {certificate}: {e}")
+            logger.error(f"Error while starting parsing for {certificate}: {e}")
             # Пропускаем задачу и не повторяем
             raise Ignore()
 
+        started = time.monotonic()
         try:
-            parser = Parser360(source, certificate, vendor)
-            asyncio.run(parser.use_parser())
-            log.log = log.log + f"\nParsing completed successfully\n----\n"
-            log.save()
-        except SoftTimeLimitExceeded:
-            logger.error(f"Soft time limit exceeded while parsing {certificate}")
-            log.log = log.log + f"\nSoft time limit exceeded while parsing\n----\n"
-            log.save()
-            # Удаляем камень по сертификату
-            Stone.objects.filter(certificate=certificate).delete()
-            raise Ignore()  # Пропускаем задачу
+            # A retry resumes from the saved frames, recreating the stone under DEBUG would drop them
+            parser = Parser360(source, certificate, vendor, recreate=False if self.request.retries or resume else None)
+            asyncio.run(run_parse(parser.use_parser()))
+            record_event(certificate, 'parse', ParseEvent.SUCCEEDED, time.monotonic() - started)
+            set_state(certificate, StoneParseState.SUCCEEDED, image_count=parser.image_count)
+            on_parsed(certificate)
         except Exception as e:
-            if 'Server has gone away' in str(e):
-                logger.error(f"Database connection lost while parsing {certificate}: {e}")
-                try:
-                    # Закрываем текущее соединение
-                    connection.close()
-                    # Пытаемся переподключиться
-                    connection.connect()
-                    logger.warning(f"Reconnected to the database for {certificate}")
-                    # После успешного переподключения повторяем попытку выполнения парсинга
-                    parser = Parser360(source, certificate, vendor)
-                    asyncio.run(parser.use_parser())
-                    log.log = log.log + f"\nParsing completed successfully after reconnect\n----\n"
-                    log.save()
-                except Exception as reconnect_error:
-                    logger.error(f"Failed to reconnect to the database for {certificate}: {reconnect_error}")
-                    log.log = log.log + f"\nFailed to reconnect: {reconnect_error}\n----\n"
-                    log.save()
-                    Stone.objects.filter(certificate=certificate).delete()
-                    raise Ignore()  # Пропускаем задачу
-            else:
-                logger.error(f"Error while parsing {certificate}: {e}")
-                log.log = log.log + f"\nError while parsing {e}\n----\n"
-                log.save()
-                # Удаляем объект с ошибкой, чтобы не оставлять некорректные данные
-                Stone.objects.filter(certificate=certificate).delete()
-                # Пропускаем задачу, не повторяем её
-                raise Ignore()
+            if is_connection_error(e):
+                # Закрываем соединение, Django переподключится при следующем запросе
+                connection.close()
+
+            if is_transient(e) and self.request.retries < settings.PARSER_RETRY_MAX:
+                countdown = retry_countdown(self.request.retries)
+                logger.warning(f"Transient error while parsing {certificate}, "
+                               f"retry {self.request.retries + 1}/{settings.PARSER_RETRY_MAX} in {countdown:.0f}s: {e}")
+                record_event(certificate, 'parse', ParseEvent.RETRYING, time.monotonic() - started, e)
+                # Камень и скачанные кадры остаются, повтор докачивает только недостающие
+                set_state(certificate, StoneParseState.QUEUED, error=str(e))
+                raise self.retry(exc=e, countdown=countdown, max_retries=settings.PARSER_RETRY_MAX)
+
+            logger.error(f"Error while parsing {certificate}: {e}")
+            fail_parse(certificate, e, time.monotonic() - started)
+            # Пропускаем задачу, не повторяем её
+            raise Ignore()
     else:
         logger.warning(f"Invalid data for parsing: source={source}, certificate={certificate}")
         raise Ignore()
 
 
+def fail_parse(certificate, error, duration=None):
+    record_event(certificate, 'parse', ParseEvent.FAILED, duration, error)
+    # Удаляем объект с ошибкой, чтобы не оставлять некорректные данные
+    Stone.objects.filter(certificate=certificate).delete()
+    clear_checkpoint(certificate)
+    set_state(certificate, StoneParseState.FAILED, error=str(error))
+
+
+def retry_later(source, certificate, vendor, error, duration=None):
+    # A stone from a batch is retried on its own, the rest of the batch is not held back
+    countdown = retry_countdown(0)
+    record_event(certificate, 'parse', ParseEvent.RETRYING, duration, error)
+    set_state(certificate, StoneParseState.QUEUED, error=str(error))
+    parse_v360_data.apply_async(
+        (source, certificate, vendor),
+        {'resume': True},
+        countdown=countdown,
+        queue=settings.QUEUE_BULK,
+        priority=settings.QUEUE_PRIORITIES[settings.QUEUE_BULK],
+    )
+
+
+def on_parsed(certificate):
+    # Post-processing runs in the background, the stone is viewable already.
+    # A broker error here is only logged, it must not fail a parsed stone
+    try:
+        build_atlas.delay(certificate)
+        build_derivatives.delay(certificate)
+        build_previews.delay(certificate)
+    except Exception as e:
+        logger.error(f"Error while queueing post-processing for {certificate}: {e}")
+
+
+async def run_parse(coroutine):
+    # Each task runs its own loop, clients bound to it are closed before asyncio.run closes it
+    try:
+        return await coroutine
+    finally:
+        await frame_fetcher.aclose()
+        await host_limiter.aclose()
+
+
+async def parse_batch(diamonds, concurrency, finished):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def parse_one(diamond):
+        source, certificate, vendor = diamond.get('source'), diamond.get('certificate'), diamond.get('vendor')
+        if not source or not certificate:
+            logger.warning(f"Invalid data for parsing: source={source}, certificate={certificate}")
+            return certificate, {'status': 'invalid'}
+
+        async with semaphore:
+            logger.warning(f"Starting parsing for {certificate}")
+            started = time.monotonic()
+            try:
+                record_event(certificate, 'parse', ParseEvent.STARTED)
+                await sync_to_async(set_state)(certificate, StoneParseState.RUNNING)
+                # Bulk feeds never drop stones that are already parsed
+                parser = Parser360(source, certificate, vendor, recreate=False)
+                await parser.use_parser()
+                record_event(certificate, 'parse', ParseEvent.SUCCEEDED, time.monotonic() - started)
+                await sync_to_async(set_state)(certificate, StoneParseState.SUCCEEDED, image_count=parser.image_count)
+                await sync_to_async(on_parsed)(certificate)
+                finished.add(certificate)
+                return certificate, {'status': 'success', 'image_count': parser.image_count}
+            except Exception as e:
+                # Not marked finished in a finally, stones cancelled by the time limit are retried
+                try:
+                    if is_transient(e):
+                        logger.warning(f"Transient error while parsing {certificate}, retrying separately: {e}")
+                        await sync_to_async(retry_later)(source, certificate, vendor, e, time.monotonic() - started)
+                        finished.add(certificate)
+                        return certificate, {'status': 'retrying', 'error': str(e)}
+                    logger.error(f"Error while parsing {certificate}: {e}")
+                    await sync_to_async(fail_parse)(certificate, e, time.monotonic() - started)
+                    finished.add(certificate)
+                except Exception as cleanup_error:
+                    logger.error(f"Error while cleaning up {certificate}: {cleanup_error}")
+                return certificate, {'status': 'error', 'error': str(e)}
+
+    return dict(await asyncio.gather(*(parse_one(diamond) for diamond in diamonds)))
+
+
+@shared_task(bind=True, time_limit=3600, soft_time_limit=3540)
+def parse_v360_batch(self, diamonds):
+    finished = set()
+    try:
+        results = asyncio.run(run_parse(parse_batch(diamonds, settings.PARSER_BATCH_CONCURRENCY, finished)))
+    except SoftTimeLimitExceeded:
+        pending = [diamond for diamond in diamonds if diamond.get('certificate') and diamond.get('certificate') not in finished]
+        logger.error(f"Soft time limit exceeded while parsing batch, {len(pending)} stones retried separately")
+        # Unfinished stones keep their frames, each one resumes in its own task
+        for diamond in pending:
+            retry_later(diamond.get('source'), diamond.get('certificate'), diamond.get('vendor'), 'Soft time limit exceeded')
+        raise Ignore()
+
+    succeeded = sum(1 for result in results.values() if result['status'] == 'success')
+    logger.warning(f"Batch parsed: {succeeded}/{len(diamonds)} succeeded")
+    return results
+
+
 @shared_task(bind=True)
-def make_queue(self, diamonds):
-    logger.info("Starting to create queue of tasks for parsing")
-    for diamond in diamonds:
-        parse_v360_data.delay(diamond['source'], diamond['certificate'], diamond['vendor'])
+def make_queue(self, diamonds, batch_id=None):
+    logger.info(f"Starting to create queue of tasks for parsing batch {batch_id}")
+    batch_size = settings.PARSER_BATCH_SIZE
+    for start in range(0, len(diamonds), batch_size):
+        parse_v360_batch.delay(diamonds[start:start + batch_size])
     return True
+
+
+
+@shared_task(bind=True, time_limit=600, soft_time_limit=570)
+def build_atlas(self, certificate):
+    try:
+        stone = Stone.objects.get(certificate=certificate)
+        build_stone_atlas(stone)
+    except Stone.DoesNotExist:
+        logger.warning(f"Stone {certificate} not found for atlas")
+        raise Ignore()
+    except Exception as e:
+        logger.error(f"Error while building atlas for {certificate}: {e}")
+        raise Ignore()
+
+
+@shared_task(bind=True, time_limit=900, soft_time_limit=870)
+def build_derivatives(self, certificate):
+    try:
+        stone = Stone.objects.get(certificate=certificate)
+        build_stone_derivatives(stone)
+        # Resolution chunks were served from the source frames until now
+        invalidate_chunks(certificate)
+    except Stone.DoesNotExist:
+        logger.warning(f"Stone {certificate} not found for derivatives")
+        raise Ignore()
+    except Exception as e:
+        logger.error(f"Error while building derivatives for {certificate}: {e}")
+        raise Ignore()
+
+
+@shared_task(bind=True, time_limit=1800, soft_time_limit=1740)
+def render_video(self, certificate):
+    fingerprint = None
+    try:
+        stone = Stone.objects.get(certificate=certificate)
+        fingerprint = stone_fingerprint(stone)
+        if fingerprint and video_exists(certificate, fingerprint):
+            return True
+
+        rendered_path = generate_video(certificate)
+        store_video(certificate, fingerprint, rendered_path)
+        return True
+    except Stone.DoesNotExist:
+        logger.warning(f"Stone {certificate} not found for video")
+        raise Ignore()
+    except Exception as e:
+        logger.error(f"Error while rendering video for {certificate}: {e}")
+        if fingerprint:
+            # The lock is released below, without the marker every poll would queue the same failing render
+            mark_render_failed(certificate, fingerprint)
+        raise Ignore()
+    finally:
+        cache.delete(render_lock_key(certificate))
+
+
+@shared_task(bind=True, time_limit=900, soft_time_limit=870)
+def build_previews(self, certificate):
+    try:
+        stone = Stone.objects.get(certificate=certificate)
+        build_stone_previews(stone)
+    except Stone.DoesNotExist:
+        logger.warning(f"Stone {certificate} not found for previews")
+        raise Ignore()
+    except Exception as e:
+        logger.error(f"Error while building previews for {certificate}: {e}")
+        # The lock is released below, without the marker every request would queue the same failing build
+        mark_previews_failed(certificate)
+        raise Ignore()
+    finally:
+        cache.delete(previews_lock_key(certificate))
+
+
+@shared_task(bind=True)
+def prune_parse_events(self):
+    deleted = prune_events()
+    logger.info(f"Pruned {deleted} parse events older than {settings.PARSE_EVENTS_RETENTION_DAYS} days")
+    return deleted
+
+
+@shared_task(bind=True)
+def sweep_frame_blobs(self):
+    # Blobs whose last reference was released without removing the file, e.g. after a failed release
+    removed = sweep_blobs()
+    logger.info(f"Swept {removed} unreferenced frame blobs")
+    return removed
@@ -1,12 +1,16 @@
 from django.urls import path
-from .views import ParseStone, ParseStoneView, GetVideoView, ParseStoneHandle, ParseStatusView
+from .views import ParseStone, ParseStoneView, ChunkBundlesView, GetVideoView, PreviewView, ParseStoneHandle, ParseStatusView, ParseStateView, QueueDepthView
 from .admin_actions import add_default_patterns
 
 urlpatterns = [
     path('parse/', ParseStone.as_view(), name='parse-stone'),
     path('parse/handle/', ParseStoneHandle.as_view(), name='parse-stone-handle'),
     path('get/<certificate>/', ParseStoneView.as_view(), name='get-stone'),
+    path('get/<certificate>/bundles/', ChunkBundlesView.as_view(), name='get-stone-bundles'),
     path('get-video/<certificate>/', GetVideoView.as_view(), name='get-video'),
+    path('preview/<certificate>/<preview_format>/', PreviewView.as_view(), name='get-preview'),
     path('patterns/', add_default_patterns, name='add-default-patterns'),
-    path('status/',ParseStatusView.as_view(), name='parse-status')
+    path('status/',ParseStatusView.as_view(), name='parse-status'),
+    path('status/bulk/', ParseStateView.as_view(), name='parse-state'),
+    path('queues/', QueueDepthView.as_view(), name='queue-depths'),
 ]
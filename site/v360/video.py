@@ -1,70 +1,86 @@
 import os
+import shutil
 import logging
-from moviepy.editor import ImageSequenceClip
-from .models import Stone, StoneImages
-from PIL import Image
+import subprocess
+import tempfile
+import imageio_ffmpeg
+from .metrics import stage_timer
+from .models import Stone
 from django.conf import settings  # Импортируем настройки для доступа к MEDIA_ROOT
 
 logger = logging.getLogger(__name__)
 
-def generate_video(certificate: str) -> str:
+# Presets are x264/x265 options, other encoders ignore them
+PRESET_CODECS = ('libx264', 'libx265')
+
+
+def encode_frames(image_paths: list[str], output_path: str, fps: int, codec: str, preset: str, crf: int, filters: list[str] | None = None):
+    # Frames are piped to ffmpeg one file at a time, memory stays at one frame
+    video_filters = ['pad=ceil(iw/2)*2:ceil(ih/2)*2'] + (filters or [])
+    command = [
+        imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'error',
+        '-f', 'image2pipe', '-framerate', str(fps), '-i', '-',
+        '-vf', ','.join(video_filters),
+        '-c:v', codec, '-crf', str(crf), '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
+    ]
+    if codec in PRESET_CODECS:
+        command += ['-preset', preset]
+    command.append(output_path)
+
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=stderr)
+        try:
+            for path in image_paths:
+                with open(path, 'rb') as image_file:
+                    shutil.copyfileobj(image_file, process.stdin)
+        except BrokenPipeError:
+            pass  # ffmpeg exited early, the error is in stderr
+        finally:
+            process.stdin.close()
+
+        if process.wait() != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"ffmpeg failed: {stderr.read().decode(errors='replace')[-2000:]}")
+
+
+def generate_video(certificate: str, fps: int | None = None, codec: str | None = None, preset: str | None = None, crf: int | None = None) -> str:
     try:
         logger.info(f"Start generating video for certificate: {certificate}")
-        
+
         stone = Stone.objects.get(certificate=certificate)
         logger.info(f"Stone object found: {stone.id}")
 
-        images = StoneImages.objects.filter(stone=stone).order_by('id')
-        logger.info(f"Found {images.count()} images for stone: {stone.id}")
+        # Получаем список путей к изображениям на сервере
+        image_paths = stone.frame_paths()
+        logger.info(f"Found {len(image_paths)} images for stone: {stone.id}")
 
         temp_dir = os.path.join(settings.MEDIA_ROOT, 'tmp', certificate)  # Используем MEDIA_ROOT
         os.makedirs(temp_dir, exist_ok=True)
         logger.info(f"Temporary directory created: {temp_dir}")
 
-        # Получаем список путей к изображениям на сервере
-        image_paths = [os.path.join(settings.MEDIA_ROOT, image.image.name) for image in images]
-
         if not image_paths:
             logger.error(f"No images found for stone: {certificate}")
             raise ValueError("No images found for this stone.")
 
-        # Проверяем существование файлов и обрабатываем изображения
         for path in image_paths:
             if not os.path.exists(path):
                 logger.error(f"File not found: {path}")
                 raise FileNotFoundError(f"No such file: '{path}'")
 
-            img = Image.open(path)
-            width, height = img.size
-            logger.info(f"Processing image {path}, size: {width}x{height}")
-
-            if height % 2 != 0:
-                new_height = (height // 2) * 2
-                img = img.resize((width, new_height), Image.Resampling.LANCZOS)
-                img.save(path)
-                logger.info(f"Image resized and saved: {path}, new height: {new_height}")
-
         # Генерируем путь для видеофайла
         video_path = os.path.join(temp_dir, f'{certificate}.mp4')
-        fps = 24
         logger.info(f"Video will be saved to: {video_path}")
 
-        clip = ImageSequenceClip(image_paths, fps=fps)
-        logger.info(f"Video clip created with {fps} FPS")
-
-        width, height = clip.size
-        if height % 2 != 0:
-            clip = clip.resize(height=(height // 2) * 2)
-            logger.info(f"Clip resized, new size: {clip.size}")
-
-        clip.write_videofile(
-            video_path,
-            codec='libx264',
-            audio=False,
-            threads=4,
-            preset='slow',
-            ffmpeg_params=['-pix_fmt', 'yuv420p']
-        )
+        # Odd dimensions are padded by ffmpeg, source frames stay untouched
+        with stage_timer('video_encode'):
+            encode_frames(
+                image_paths,
+                video_path,
+                fps=fps or settings.VIDEO_FPS,
+                codec=codec or settings.VIDEO_CODEC,
+                preset=preset or settings.VIDEO_PRESET,
+                crf=crf if crf is not None else settings.VIDEO_CRF,
+            )
         logger.info(f"Video successfully written to {video_path}")
 
         return video_path
@@ -0,0 +1,162 @@
+import hashlib
+import logging
+import os
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .bundles import frames_version
+from .models import is_blob_name
+from .storage import IMMUTABLE, delete_media, is_remote, media_exists, media_url, upload_file
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+
+def get_video_folder_path(certificate: str):
+    return os.path.join('videos', certificate)
+
+
+def stone_fingerprint(stone) -> str | None:
+    names = stone.frame_names()
+    if not names:
+        return None
+    if all(is_blob_name(name) for name in names):
+        # Blob names are content hashes, no frame has to be read or downloaded
+        return frames_version(names)
+    return frames_version(stone.frame_paths())
+
+
+def cached_video_name(certificate: str, fingerprint: str) -> str:
+    return os.path.join(get_video_folder_path(certificate), f'{fingerprint}.mp4')
+
+
+def get_cached_video(certificate: str, fingerprint: str) -> str | None:
+    path = os.path.join(settings.MEDIA_ROOT, cached_video_name(certificate, fingerprint))
+    if not os.path.exists(path):
+        return None
+    # Touch access time on hit, eviction drops the least recently used files first.
+    # mtime is kept, it is the Last-Modified of the response
+    os.utime(path, (time.time(), os.stat(path).st_mtime))
+    return path
+
+
+def video_exists(certificate: str, fingerprint: str) -> bool:
+    if is_remote():
+        return media_exists(cached_video_name(certificate, fingerprint))
+    return get_cached_video(certificate, fingerprint) is not None
+
+
+def get_video_url(certificate: str, fingerprint: str) -> str | None:
+    # Remote storage only, the video is served by the bucket or the CDN
+    name = cached_video_name(certificate, fingerprint)
+    if not media_exists(name):
+        return None
+    return media_url(name, filename=f'{certificate}.mp4')
+
+
+def content_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def video_etag(path: str) -> str:
+    # The content hash is computed once at store time and kept next to the video
+    try:
+        with open(path + '.sha256') as etag_file:
+            return etag_file.read().strip()
+    except FileNotFoundError:
+        etag = content_hash(path)
+        with open(path + '.sha256', 'w') as etag_file:
+            etag_file.write(etag)
+        return etag
+
+
+def render_lock_key(certificate: str) -> str:
+    return f'v360:video:render:{certificate}'
+
+
+def render_failed_key(certificate: str, fingerprint: str) -> str:
+    return f'v360:video:failed:{certificate}:{fingerprint}'
+
+
+def mark_render_failed(certificate: str, fingerprint: str):
+    # Keyed by the frame set, a re-parse can be rendered right away
+    cache.set(render_failed_key(certificate, fingerprint), 1, settings.VIDEO_RENDER_FAILED_SECONDS)
+
+
+def render_failed(certificate: str, fingerprint: str) -> bool:
+    return cache.get(render_failed_key(certificate, fingerprint)) is not None
+
+
+def request_render(certificate: str) -> bool:
+    # Single flight: only the first request enqueues, the rest wait for the same render
+    from .tasks import render_video
+    if not cache.add(render_lock_key(certificate), 1, settings.VIDEO_RENDER_LOCK_SECONDS):
+        return False
+    render_video.delay(certificate)
+    return True
+
+
+def store_video(certificate: str, fingerprint: str, rendered_path: str) -> str:
+    if is_remote():
+        return publish_video(certificate, fingerprint, rendered_path)
+
+    folder = os.path.join(settings.MEDIA_ROOT, get_video_folder_path(certificate))
+    os.makedirs(folder, exist_ok=True)
+
+    path = os.path.join(settings.MEDIA_ROOT, cached_video_name(certificate, fingerprint))
+    os.replace(rendered_path, path)
+    with open(path + '.sha256', 'w') as etag_file:
+        etag_file.write(content_hash(path))
+
+    # Renders of older frame sets are never served again
+    for entry in os.scandir(folder):
+        if entry.path not in (path, path + '.sha256'):
+            os.remove(entry.path)
+
+    evict_videos(settings.VIDEO_CACHE_MAX_MB * 1024 * 1024)
+    return path
+
+
+def publish_video(certificate: str, fingerprint: str, rendered_path: str) -> str:
+    name = cached_video_name(certificate, fingerprint)
+    upload_file(rendered_path, name, cache_control=IMMUTABLE)
+
+    folder = get_video_folder_path(certificate)
+    for filename in default_storage.listdir(folder)[1]:
+        if filename != os.path.basename(name):
+            delete_media(os.path.join(folder, filename))
+
+    # The bucket serves it, the worker keeps no copy
+    os.remove(rendered_path)
+    return name
+
+
+def evict_videos(max_bytes: int):
+    root = os.path.join(settings.MEDIA_ROOT, 'videos')
+    if not os.path.isdir(root):
+        return
+
+    files = []
+    for folder in os.scandir(root):
+        if folder.is_dir():
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith('.mp4'):
+                    stat = entry.stat()
+                    files.append((stat.st_atime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            if os.path.exists(path + '.sha256'):
+                os.remove(path + '.sha256')
+            total -= size
+            logger.info(f"Evicted cached video {path}")
+        except FileNotFoundError:
+            pass
@@ -5,14 +5,27 @@ from django.http import HttpResponse
 from asgiref.sync import async_to_sync
 from django.shortcuts import render
 from .parser import Parser360
-from .models import Stone, StoneImages
+from .models import Stone, StoneParseState
+from .parse_state import get_states, set_state
 import os
 import json
-from .video import generate_video
-from .tasks import make_queue, parse_v360_data
+from .video_cache import stone_fingerprint, get_cached_video, get_video_url, cached_video_name, render_failed, request_render, video_etag
+from .storage import fetch_files, is_remote, media_url
+from .file_response import serve_file
+from .tasks import parse_v360_data
+from .ingest import ingest_diamonds
+from .queues import queue_depths
+from .metrics import render_metrics
 from django.conf import settings
 import logging
-from .chunk_process import chunk_maker
+from .chunk_process import chunk_key_points, chunk_maker
+from .chunk_cache import chunk_variant, encode_chunk, ensure_chunk_version, get_cached_chunk, store_chunk
+from .bundles import read_manifest, get_bundles_folder_path
+from .derivatives import derivative_folder, derivative_paths, pick_derivative
+from .atlas import read_atlas_manifest
+from django.utils.cache import patch_cache_control
+from django.shortcuts import redirect
+from .previews import PREVIEW_CONTENT_TYPES, previews_failed, read_previews_manifest, request_previews
 from django.http import HttpResponse
 
 logger = logging.getLogger(__name__)
@@ -29,6 +42,7 @@ class ParseStoneHandle(APIView):
         url = request.data['url']
         vendor = 'handle'
         try:
+            set_state(certificate, StoneParseState.QUEUED)
             parse_v360_data.delay(url, certificate, vendor)
             return Response({'status': 'success'}, content_type='application/json', status=200)
         except Exception as e:
@@ -41,8 +55,8 @@ class ParseStone(APIView):
         diamonds = request.data
         try:
             logger.warning(f"Starting queue for {len(diamonds)} diamonds")
-            make_queue.delay(diamonds)
-            return Response({'status': 'success'}, content_type='application/json', status=200)
+            batch = ingest_diamonds(diamonds)
+            return Response({'status': 'success', **batch}, content_type='application/json', status=200)
         except Exception as e:
             logger.error(f'{e}')
             return Response({'status': 'error'}, content_type='application/json', status=500)    
@@ -50,65 +64,190 @@ class ParseStone(APIView):
             
 class ParseStoneView(APIView):
     def get(self, request, certificate):
-        first_image = StoneImages.objects.filter(stone__certificate=certificate).first()
-
         try:
-            Stone.objects.get(certificate=certificate)
+            stone = Stone.objects.get(certificate=certificate)
         except:
             return render(request, '404.html', status=404)
         
         try:
-            return render(request, '360.html', {'certificate': certificate, 'first_image': first_image.image.url})
+            first_image = media_url(stone.frame_names()[0])
+            return render(request, '360.html', {'certificate': certificate, 'first_image': first_image})
         except Exception as e:
             logger.error(f'{e}')
             return render(request, '404.html', status=404)
     
     def post(self, request, certificate):
+        payload = json.loads(request.data)
+        request_index = payload.get('chunk_index')
+
+        if payload.get('resolution'):
+            # Any viewport width, the smallest derivative covering it or the originals are served
+            resolution = str(payload['resolution'])
+            if not resolution.isdigit() or not int(resolution):
+                return Response({'error': 'invalid resolution'}, content_type='application/json', status=400)
+            payload['resolution'] = int(resolution)
+
+        # Repeat views are served from the chunk cache without the database or the frame files
+        derivative = variant = version = None
+        if not payload.get('atlas'):
+            if payload.get('resolution'):
+                derivative = pick_derivative(certificate, payload['resolution'], payload.get('format'))
+            variant = chunk_variant(derivative)
+            version, content = get_cached_chunk(certificate, variant, request_index)
+            if content is not None:
+                return HttpResponse(content, content_type='application/json')
+
         try:
             stone = Stone.objects.get(certificate=certificate)
         except:
             return Response({'error': 'error'}, content_type='application/json', status=500)
 
-        images = list(StoneImages.objects.filter(stone=stone).values_list('image', flat=True))
-
-        image_paths = [os.path.join(settings.MEDIA_ROOT, image) for image in images]
-
-        request_index = json.loads(request.data)['chunk_index']
+        if payload.get('atlas'):
+            atlas = read_atlas_manifest(certificate)
+            if not atlas:
+                return Response({'error': 'not found'}, content_type='application/json', status=404)
+            return Response(atlas, content_type='application/json')
+
+        if derivative:
+            image_paths = derivative_paths(*derivative)
+        else:
+            # Only the frames of this chunk, a remote storage would download the whole set otherwise
+            names = stone.frame_names()
+            image_paths = fetch_files(names, chunk_key_points(len(names), request_index))
+
+        content = encode_chunk(chunk_maker(image_paths, request_index))
+        if version:
+            store_chunk(certificate, version, variant, request_index, content)
+        else:
+            ensure_chunk_version(stone)
+        return HttpResponse(content, content_type='application/json')
+
+class ChunkBundlesView(APIView):
+    def get(self, request, certificate):
+        bundles_dir = None
+        resolution = request.query_params.get('resolution')
+        if resolution and resolution.isdigit():
+            bundles_dir = derivative_folder(certificate, int(resolution))
+        if bundles_dir:
+            bundles_dir = os.path.join(bundles_dir, 'bundles')
+        else:
+            bundles_dir = get_bundles_folder_path(certificate)
+
+        manifest = read_manifest(bundles_dir)
+        if not manifest:
+            return Response({'error': 'not found'}, content_type='application/json', status=404)
+        response = Response(manifest, content_type='application/json')
+        # Bundles are immutable per version, only the manifest changes on re-parse
+        patch_cache_control(response, public=True, max_age=60)
+        return response
 
-        chunk = chunk_maker(image_paths, request_index)
-        return Response(chunk, content_type='application/json')
 
 class GetVideoView(APIView):
     def get(self, request, certificate):
         try:
-            video_path = generate_video(certificate)
-            with open(video_path, 'rb') as video_file:
-                video = video_file.read()
-            response = HttpResponse(video, content_type='video/mp4')
-            response['Content-Disposition'] = f'attachment; filename="{certificate}.mp4"'
-            if os.path.exists(video_path):
-                os.remove(video_path)
+            stone = Stone.objects.get(certificate=certificate)
+        except Stone.DoesNotExist:
+            return HttpResponse(status=404)
+
+        try:
+            fingerprint = stone_fingerprint(stone)
+            if not fingerprint:
+                return HttpResponse(status=404)
+
+            if is_remote():
+                video_url = get_video_url(certificate, fingerprint)
+                if video_url:
+                    return redirect(video_url)
+
+            video_path = None if is_remote() else get_cached_video(certificate, fingerprint)
+            if video_path:
+                accel_path = settings.MEDIA_URL + cached_video_name(certificate, fingerprint) if settings.VIDEO_X_ACCEL else None
+                return serve_file(request, video_path, 'video/mp4', f'{certificate}.mp4', video_etag(video_path), accel_path)
+
+            if render_failed(certificate, fingerprint):
+                response = Response({'status': 'failed'}, content_type='application/json', status=503)
+                response['Retry-After'] = str(settings.VIDEO_RENDER_FAILED_SECONDS)
+                return response
+
+            # Rendering happens in celery, concurrent requests share one render
+            request_render(certificate)
+            response = Response({'status': 'rendering'}, content_type='application/json', status=202)
+            response['Retry-After'] = '10'
             return response
         except Exception as e:
             logger.error(f'Video Creation Error{certificate} - {str(e)}')
             return HttpResponse(status=500)
 
 
+class PreviewView(APIView):
+    def get(self, request, certificate, preview_format):
+        # Formats missing from PREVIEWS are never built, requesting them would queue builds forever
+        if preview_format not in PREVIEW_CONTENT_TYPES or preview_format not in settings.PREVIEWS:
+            return HttpResponse(status=404)
+
+        manifest = read_previews_manifest(certificate)
+        if manifest and preview_format in manifest['files']:
+            # Preview files are immutable per version, nginx serves them from /media/
+            response = redirect(settings.MEDIA_URL + manifest['files'][preview_format])
+            patch_cache_control(response, public=True, max_age=60)
+            return response
+
+        if previews_failed(certificate, manifest, preview_format):
+            return HttpResponse(status=404)
+
+        if not Stone.objects.filter(certificate=certificate).exists():
+            return HttpResponse(status=404)
+
+        request_previews(certificate)
+        response = Response({'status': 'rendering'}, content_type='application/json', status=202)
+        response['Retry-After'] = '10'
+        return response
+
+
 class ParseStatusView(APIView):
     def post(self, request):
         try:
             diamonds = request.data
 
-            logger.warning(f"Checking status for {len(diamonds)}")
+            states = get_states(diamonds)
+            parsed = [certificate for certificate, state in states.items() if state['state'] == StoneParseState.SUCCEEDED]
+
+            logger.info(f"Checked status for {len(diamonds)}, {len(parsed)} parsed")
+
+            return Response(parsed, status=200)
+
+        except Exception as e:
+            logger.error(f'{e}')
+            return Response({'status': 'error', 'message': str(e)}, status=500)
 
-            stones = Stone.objects.filter(certificate__in=diamonds)
 
-            parsed = list(stones.values_list('certificate', flat=True))
+class ParseStateView(APIView):
+    def post(self, request):
+        try:
+            diamonds = request.data
+            states = get_states(diamonds)
 
-            logger.warning(f"Already parsed: {parsed}")
+            logger.info(f"Checked parse state for {len(diamonds)}, {len(states)} known")
 
-            return Response(parsed, status=200)
+            # Certificates that were never queued are left out of the response
+            return Response(states, status=200)
 
         except Exception as e:
             logger.error(f'{e}')
             return Response({'status': 'error', 'message': str(e)}, status=500)
+
+
+class QueueDepthView(APIView):
+    def get(self, request):
+        try:
+            return Response({'queues': queue_depths()}, status=200)
+        except Exception as e:
+            logger.error(f'{e}')
+            return Response({'status': 'error', 'message': str(e)}, status=500)
+
+
+class MetricsView(APIView):
+    def get(self, request):
+        # Aggregated over the site and all worker processes sharing PROMETHEUS_MULTIPROC_DIR
+        output, content_type = render_metrics()
+        return HttpResponse(output, content_type=content_type)